@@ -1,6 +1,8 @@
 from flask import Flask
 from flask_session import Session
-from .models import init_db
+from .migrations import migrate
+from .understat_client import init_understat_client
+from .db import init_db_pool
 
 def create_app():
     app = Flask(__name__)
@@ -16,8 +18,21 @@ def create_app():
     
     Session(app)
 
+    # Pooled WAL sqlite connections, one per request
+    init_db_pool(app)
+
+    # Bring the schema up to date once here instead of on every request
+    if app.config.get("AUTO_MIGRATE", True):
+        migrate()
+
+    # One pooled Understat session for the whole app
+    init_understat_client(app)
+
     # Register routes
     from .routes import main
     app.register_blueprint(main)
 
+    from .cli import register_commands
+    register_commands(app)
+
     return app
\ No newline at end of file
@@ -0,0 +1,44 @@
+import functools
+from . import models
+from .db import run_in_db_thread
+
+'''ASYNC MODELS'''
+# The models.py functions the async views use, run on the DB thread pool (db.run_in_db_thread) so
+# they don't hold up the event loop. Calling one starts the query and returns a future, so a view can
+# start its reads, await Understat, then await the reads:
+#
+#     bets = async_models.get_user_predictions(user["id"])
+#     fixtures = await understat.get_league_fixtures(league_code, CURRENT_SEASON)
+#     bets = await bets
+
+def awaitable(func):
+    @functools.wraps(func)
+    def start(*args, **kwargs):
+        return run_in_db_thread(func, *args, **kwargs)
+    return start
+
+def discard(*reads):
+    """Drop reads a view started but won't use (early returns, errors): cancel them, or if they've already
+    finished, collect any error so it isn't logged as never retrieved"""
+    for read in reads:
+        if read is not None and not read.cancel():
+            read.exception()
+
+# Users
+update_user = awaitable(models.update_user)
+
+# Bets and predictions
+get_user_predictions = awaitable(models.get_user_predictions)
+get_user_player_predictions = awaitable(models.get_user_player_predictions)
+place_bet = awaitable(models.place_bet)
+place_player_bets = awaitable(models.place_player_bets)
+process_match_bets = awaitable(models.process_match_bets)
+get_match_prediction = awaitable(models.get_match_prediction)
+save_match_predictions = awaitable(models.save_match_predictions)
+
+# Leagues
+get_league_by_id = awaitable(models.get_league_by_id)
+get_league_names = awaitable(models.get_league_names)
+get_league_members = awaitable(models.get_league_members)
+get_league_leaderboard = awaitable(models.get_league_leaderboard)
+get_recent_league_bets = awaitable(models.get_recent_league_bets)
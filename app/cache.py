@@ -0,0 +1,71 @@
+import threading
+import time
+from collections import OrderedDict
+
+'''IN MEMORY CACHE'''
+class TTLCache:
+    """Bounded LRU cache where every entry carries its own expiry time"""
+    def __init__(self, maxsize=512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()  # Request threads and the Understat loop thread both use this
+
+    def get(self, key, default=None):
+        """Return a cached value, or default if it's missing or expired"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return default
+            expires_at, value = entry
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)  # Most recently used goes to the back
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Like get but doesn't count as a hit/miss or change LRU order"""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or (entry[0] is not None and entry[0] <= time.monotonic()):
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl=None):
+        """Store a value for ttl seconds. ttl=None means keep until evicted."""
+        expires_at = time.monotonic() + ttl if ttl is not None else None
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)  # Drop least recently used
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else 0.0
+            }
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,109 @@
+import asyncio
+import click
+from flask import current_app
+from .understat_client import get_understat_client
+from .understat_mirror import sync_mirror
+from .leagues import LEAGUE_MAPPING, CURRENT_SEASON
+from .prediction_model import PredictionSystem
+from .models import (save_match_predictions, rebuild_all_leaderboards, snapshot_points_ledger, check_points_ledger,
+                     get_user, get_points_history, ledger_balance, archive_settled_predictions, ARCHIVE_AFTER_DAYS)
+from .migrations import migrate, MIGRATIONS
+from .query_plans import explain_hot_queries
+
+'''FLASK CLI COMMANDS'''
+def register_commands(app):
+    @app.cli.command("migrate-db")
+    def migrate_db():
+        """Apply any pending schema migrations (create_app also does this unless AUTO_MIGRATE = False)."""
+        applied = migrate()
+        if applied:
+            click.echo(f"Applied migrations {applied}, now at version {MIGRATIONS[-1][0]}")
+        else:
+            click.echo(f"Nothing to apply, at version {MIGRATIONS[-1][0]}")
+
+    @app.cli.command("explain-queries")
+    def explain_queries():
+        """Print EXPLAIN QUERY PLAN for the hot queries and flag any full table scans."""
+        scans = 0
+        for name, details, has_scan in explain_hot_queries():
+            click.echo(f"{'TABLE SCAN ' if has_scan else ''}{name}")
+            for detail in details:
+                click.echo(f"    {detail}")
+            scans += has_scan
+        click.echo(f"{scans} queries with a full table scan")
+
+    @app.cli.command("rebuild-leaderboards")
+    def rebuild_leaderboards():
+        """Re-rank every league's leaderboard snapshot. Movement shown on leaderboards is since the last run."""
+        click.echo(f"Rebuilt {rebuild_all_leaderboards()} leaderboards")
+
+    @app.cli.command("snapshot-ledger")
+    def snapshot_ledger():
+        """Snapshot every balance from the points ledger so rebuilding one only replays what came after. Run it nightly."""
+        click.echo(f"Stored {snapshot_points_ledger()} balances")
+
+    @app.cli.command("check-ledger")
+    def check_ledger():
+        """List every balance in league_scores that doesn't match its points ledger."""
+        mismatches = check_points_ledger()
+        if mismatches is None:
+            click.echo("Error checking the ledger")
+            return
+        for row in mismatches:
+            click.echo(f"user {row['user_id']} league {row['league_id']}: score {row['score']}, ledger {row['ledger_balance']}")
+        click.echo(f"{len(mismatches)} balances don't match the ledger")
+
+    @app.cli.command("points-history")
+    @click.argument("username")
+    @click.option("--league", "league_id", type=int, default=1, show_default=True, help="League id, 1 is the global league")
+    @click.option("--limit", type=int, default=20, show_default=True, help="How many entries to show, newest first")
+    def points_history(username, league_id, limit):
+        """Show a user's latest points ledger entries in a league and the balance the ledger adds up to."""
+        user = get_user(username)
+        if not user:
+            click.echo(f"No user called {username}")
+            return
+        for entry in get_points_history(user["id"], league_id, limit):
+            reference = f" ({entry['reference_id']})" if entry["reference_id"] else ""
+            click.echo(f"{entry['created_at']}  {entry['delta']:+d}  {entry['reason']}{reference}")
+        click.echo(f"Ledger balance: {ledger_balance(user['id'], league_id)}")
+
+    @app.cli.command("archive-predictions")
+    @click.option("--days", type=int, default=None, help="Archive settled bets older than this. Defaults to PREDICTION_ARCHIVE_DAYS in config")
+    def archive_predictions(days):
+        """Move settled predictions past the horizon out of the live tables into the archive. Run it nightly."""
+        if days is None:
+            days = current_app.config.get("PREDICTION_ARCHIVE_DAYS", ARCHIVE_AFTER_DAYS)
+        moved = archive_settled_predictions(days)
+        if moved is None:
+            click.echo("Error archiving predictions")
+            return
+        for table, count in moved.items():
+            click.echo(f"{table}: archived {count} settled rows older than {days} days")
+
+    @app.cli.command("sync-understat")
+    @click.option("--season", default=CURRENT_SEASON, show_default=True, help="Understat season (year it starts)")
+    @click.option("--league", "leagues", multiple=True, help="League code, repeatable. Defaults to all of LEAGUE_MAPPING")
+    def sync_understat(season, leagues):
+        """Pull new Understat data into the local mirror. Run it from cron every few minutes."""
+        leagues = list(leagues) or list(LEAGUE_MAPPING)
+        summary = asyncio.run(sync_mirror(get_understat_client(), leagues, season))
+        click.echo(summary)
+
+    @app.cli.command("refresh-predictions")
+    @click.option("--season", default=CURRENT_SEASON, show_default=True, help="Understat season (year it starts)")
+    @click.option("--league", "leagues", multiple=True, help="League code, repeatable. Defaults to all of LEAGUE_MAPPING")
+    def refresh_predictions(season, leagues):
+        """Recompute the AI prediction for every upcoming fixture and store them in match_predictions."""
+        leagues = list(leagues) or list(LEAGUE_MAPPING)
+        prediction_system = PredictionSystem()
+        for league_code in leagues:
+            try:
+                predictions = asyncio.run(prediction_system.predict_matchday(league_code, season))
+            except Exception as e:
+                click.echo(f"Error predicting {league_code}: {e}")
+                continue
+            saved = save_match_predictions(predictions)
+            click.echo(f"{league_code}: stored {saved} predictions")
+        # How much of the Understat data the leagues shared (team histories, tables) came from the cache
+        click.echo(f"Understat cache: {get_understat_client().cache_stats()}")
@@ -0,0 +1,147 @@
+import asyncio
+import functools
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from flask import g, has_app_context
+
+'''SQLITE CONNECTION POOL'''
+# Opening a connection per model function meant a single bet POST did 6+ connects, and with the default
+# rollback journal readers and writers block each other ("database is locked"). Connections here are
+# opened once with WAL + pragmas, and inside a request the same one is handed out until teardown.
+
+PRAGMAS = {
+    "journal_mode": "WAL",      # Readers don't block the writer and the other way round
+    "synchronous": "NORMAL",    # Safe with WAL, only fsyncs at checkpoints
+    "cache_size": -16000,       # Negative = KiB, so ~16MB page cache per connection
+    "busy_timeout": 5000,       # Wait up to 5s for a lock instead of failing straight away
+    "temp_store": "MEMORY",
+}
+
+class PooledConnection:
+    """Wraps a sqlite3 connection. close() gives it back instead of closing it, so the model
+    functions can keep their try/finally conn.close() as is."""
+    def __init__(self, pool, conn, request_scoped=False):
+        self._pool = pool
+        self._conn = conn
+        self._request_scoped = request_scoped
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    def __enter__(self):
+        return self._conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self._conn.__exit__(*exc)
+
+    def close(self):
+        if self._conn is None:
+            return
+        # Same as closing a real connection: anything not committed is thrown away
+        if self._conn.in_transaction:
+            self._conn.rollback()
+        # The request's connection stays checked out until teardown
+        if not self._request_scoped:
+            self._pool.release(self._conn)
+            self._conn = None
+
+class ConnectionPool:
+    def __init__(self, database, size=8, pragmas=None):
+        self.database = database
+        self.size = size  # Most idle connections kept around, busy ones aren't capped
+        self.pragmas = dict(PRAGMAS, **(pragmas or {}))
+        self._idle = []
+        self._lock = threading.Lock()
+        self.opened = 0
+
+    def _connect(self):
+        # check_same_thread off: async views and teardown can run on different threads, the pool
+        # makes sure only one of them has the connection at a time
+        conn = sqlite3.connect(self.database, timeout=self.pragmas["busy_timeout"] / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for name, value in self.pragmas.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        self.opened += 1
+        return conn
+
+    def acquire(self):
+        with self._lock:
+            if self._idle:
+                return self._idle.pop()
+        return self._connect()
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def connection(self, request_scoped=True):
+        """A connection for the caller. Inside a request/app context it's the context's connection,
+        unless request_scoped=False (for code running off the request's thread)."""
+        if not request_scoped or not has_app_context():
+            return PooledConnection(self, self.acquire())
+        pooled = g.get("_db_connections", {}).get(self.database)
+        if pooled is None:
+            pooled = PooledConnection(self, self.acquire(), request_scoped=True)
+            g.setdefault("_db_connections", {})[self.database] = pooled
+        return pooled
+
+    def close_all(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+_pools = {}
+_pools_lock = threading.Lock()
+_pool_settings = {}
+
+def get_pool(database):
+    """The pool for a database file, made on first use"""
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = ConnectionPool(database, size=_pool_settings.get("size", 8), pragmas=_pool_settings.get("pragmas"))
+            _pools[database] = pool
+        return pool
+
+def release_request_connections(exc=None):
+    """Teardown: hand the context's connections back to their pools"""
+    for pooled in g.pop("_db_connections", {}).values():
+        pooled._request_scoped = False
+        pooled.close()
+
+'''DB THREAD POOL'''
+# Async views hand their queries to these threads so the event loop keeps running Understat fetches in
+# the meantime. Work here runs outside the request context, so it gets its own pooled connection
+# rather than the request's (which could be in use on the request thread at the same moment).
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_db_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=_pool_settings.get("workers", 8), thread_name_prefix="db")
+        return _executor
+
+def run_in_db_thread(func, *args, **kwargs):
+    """Start func(*args, **kwargs) on the DB thread pool and return a future for the result. It's started
+    straight away, so kick off reads before the awaits they can overlap with and await them after."""
+    # run_in_executor doesn't copy contextvars over, which is what keeps flask.g (and so the request's
+    # connection) out of the worker thread
+    return asyncio.get_running_loop().run_in_executor(get_db_executor(), functools.partial(func, *args, **kwargs))
+
+def init_db_pool(app):
+    _pool_settings["size"] = app.config.get("DB_POOL_SIZE", 8)
+    _pool_settings["workers"] = app.config.get("DB_EXECUTOR_WORKERS", _pool_settings["size"])
+    _pool_settings["pragmas"] = {
+        "busy_timeout": app.config.get("DB_BUSY_TIMEOUT_MS", PRAGMAS["busy_timeout"]),
+        "cache_size": -app.config.get("DB_CACHE_SIZE_KB", -PRAGMAS["cache_size"]),
+    }
+    app.teardown_appcontext(release_request_connections)
@@ -0,0 +1,61 @@
+import asyncio
+from flask import g, session
+from .models import get_user, get_user_leagues
+from .db import run_in_db_thread
+
+'''CURRENT USER'''
+# The logged in user's row and leagues, looked up at most once per request and kept on
+# flask.g. Routes used to call get_user(session["username"]) a few times each (prediction did it four
+# times), now they ask here. Anything that changes one of these (joining a league, editing the
+# profile) calls forget_current_user() so the rest of the request sees the new values.
+
+_MISSING = object()
+
+def _cached(key, load):
+    identity = g.setdefault("_identity", {})
+    value = identity.get(key, _MISSING)
+    if value is _MISSING:
+        value = identity[key] = load()
+    return value
+
+def current_username():
+    return session.get("username")
+
+def current_user():
+    """The users row for whoever is logged in, None if nobody is (or the account has gone)"""
+    username = current_username()
+    if not username:
+        return None
+    return _cached("user", lambda: get_user(username))
+
+def current_user_leagues():
+    """Same list as get_user_leagues(), [] when logged out"""
+    username = current_username()
+    if not username:
+        return []
+    return _cached("leagues", lambda: get_user_leagues(username))
+
+def current_user_league_ids():
+    return {league["id"] for league in current_user_leagues()}
+
+async def load_current_user():
+    """For async views: fetch the user and their leagues together on the DB thread pool, after which
+    current_user()/current_user_leagues() are cache hits. Returns the user (None if logged out)"""
+    username = current_username()
+    if not username:
+        return None
+    identity = g.setdefault("_identity", {})
+    loaders = {"user": get_user, "leagues": get_user_leagues}
+    missing = [key for key in loaders if key not in identity]
+    if missing:
+        values = await asyncio.gather(*(run_in_db_thread(loaders[key], username) for key in missing))
+        identity.update(zip(missing, values))
+    return identity["user"]
+
+def forget_current_user(*keys):
+    """Drop cached values after a write, just the ones named ("user", "leagues") or all of them"""
+    identity = g.get("_identity")
+    if not identity:
+        return
+    for key in keys or list(identity):
+        identity.pop(key, None)
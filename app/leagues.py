@@ -0,0 +1,20 @@
+'''UNDERSTAT LEAGUES'''
+LEAGUE_MAPPING = {
+    "epl": "Premier League",
+    "La_liga": "La Liga",
+    "Bundesliga": "Bundesliga", 
+    "Serie_A": "Serie A",
+    "Ligue_1": "Ligue 1"
+}
+
+LEAGUE_ICONS = {
+    "epl": "PremLogo.png",
+    "La_liga": "LaLigaLogo.png",
+    "Bundesliga": "BundesligaLogo.png",
+    "Serie_A": "SerieALogo.png", 
+    "Ligue_1": "Ligue1Logo.png"
+}
+
+DEFAULT_LEAGUE = "epl"
+
+CURRENT_SEASON = 2024  # Understat names seasons by the year they start
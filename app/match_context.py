@@ -0,0 +1,65 @@
+import asyncio
+from .understat_client import get_understat_client
+from .leagues import CURRENT_SEASON
+
+'''REQUEST SCOPED MATCH DATA'''
+# One prediction page asks for the same fixtures/table/team results from both prediction systems and
+# the template. Make one of these per request and hand it to both: it has the same methods as the
+# Understat client but each distinct call only happens once, later callers share the first result.
+class MatchContext:
+    def __init__(self, match_id, league_code=None, season=CURRENT_SEASON, max_concurrency=6):
+        self.match_id = match_id
+        self.requested_league = league_code  # From the URL, only a hint
+        self.league_code = league_code
+        self.season = season
+        self.requested_season = season
+        self.client = get_understat_client()
+        self._calls = {}  # (method, args, kwargs) -> task
+        # Prediction pages fan out to ~12 calls, this stops one page taking every pooled connection
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def _limited(self, method, *args, **kwargs):
+        async with self._semaphore:
+            return await getattr(self.client, method)(*args, **kwargs)
+
+    def _once(self, method, *args, **kwargs):
+        key = (method, args, tuple(sorted(kwargs.items())))
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._limited(method, *args, **kwargs))
+            self._calls[key] = task
+        # Shield so one caller being cancelled doesn't cancel it for the rest of the request
+        return asyncio.shield(task)
+
+    async def get_match(self):
+        """The match this context is for, as {"match", "league", "season", "is_result"} or None"""
+        entry = await self._once("find_match", self.match_id, self.requested_league, self.requested_season)
+        if entry:
+            # Use where the match really is from here on, not what the URL said
+            self.league_code = entry["league"]
+            self.season = entry["season"]
+        return entry
+
+    async def find_match(self, match_id, league_code=None, season=CURRENT_SEASON):
+        return await self._once("find_match", match_id, league_code, season)
+
+    async def get_league_fixtures(self, league_name, season, **kwargs):
+        return await self._once("get_league_fixtures", league_name, season, **kwargs)
+
+    async def get_league_results(self, league_name, season, **kwargs):
+        return await self._once("get_league_results", league_name, season, **kwargs)
+
+    async def get_league_table(self, league_name, season, **kwargs):
+        return await self._once("get_league_table", league_name, season, **kwargs)
+
+    async def get_team_results(self, team_name, season, **kwargs):
+        return await self._once("get_team_results", team_name, season, **kwargs)
+
+    async def get_team_players(self, team_name, season, **kwargs):
+        return await self._once("get_team_players", team_name, season, **kwargs)
+
+    async def get_match_players(self, match_id, **kwargs):
+        return await self._once("get_match_players", match_id, **kwargs)
+
+    async def get_match_shots(self, match_id, **kwargs):
+        return await self._once("get_match_shots", match_id, **kwargs)
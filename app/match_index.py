@@ -0,0 +1,32 @@
+import threading
+
+'''MATCH INDEX'''
+# match_id -> where it lives, so routes can find a match without scanning a whole league's fixtures.
+# Filled in by the Understat client every time a league fixtures/results list passes through it.
+INDEXED_ENDPOINTS = {"get_league_fixtures": False, "get_league_results": True}  # endpoint -> is_result
+
+class MatchIndex:
+    def __init__(self):
+        self._matches = {}  # match_id -> {"match", "league", "season", "is_result"}
+        self._lock = threading.Lock()
+
+    def add(self, match, league, season, is_result):
+        match_id = str(match["id"])
+        with self._lock:
+            existing = self._matches.get(match_id)
+            # Once a fixture has a result it stays a result, even if an older fixtures list turns up
+            if existing and existing["is_result"] and not is_result:
+                return
+            self._matches[match_id] = {"match": match, "league": league, "season": season, "is_result": is_result}
+
+    def add_league(self, matches, league, season, is_result):
+        for match in matches:
+            self.add(match, league, season, is_result)
+
+    def get(self, match_id):
+        """Return {"match", "league", "season", "is_result"} or None"""
+        with self._lock:
+            return self._matches.get(str(match_id))
+
+    def __len__(self):
+        return len(self._matches)
@@ -0,0 +1,503 @@
+from sqlite3 import Error
+from .models import get_db_connection
+
+'''SCHEMA MIGRATIONS'''
+# The schema used to be re-created with CREATE TABLE IF NOT EXISTS before every request. Now each change
+# is a numbered migration, the database remembers which ones it has (schema_migrations) and only new
+# ones run, once, from create_app() or "flask --app run migrate-db". Add new ones to the end of
+# MIGRATIONS, never edit one that has shipped.
+
+def _initial_schema(c):
+    # Same tables init_db() used to make, so existing databases just get marked as version 1
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT UNIQUE NOT NULL,
+            password_hash TEXT NOT NULL,
+            leagues TEXT DEFAULT '',
+            favourite_team TEXT DEFAULT '',
+            profile_pic TEXT NOT NULL DEFAULT 'login.png',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # fantasy league table
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fantasyLeagues (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            league_name TEXT NOT NULL,
+            league_type TEXT CHECK(league_type IN ('classic', 'seasonal')) NOT NULL,
+            privacy TEXT CHECK(privacy IN ('Public', 'Private')) NOT NULL,
+            league_code TEXT UNIQUE,
+            members TEXT DEFAULT '',
+            creator TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            season_end TIMESTAMP DEFAULT NULL
+        )
+    ''')
+    # User predictions
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            match_id TEXT NOT NULL,
+            home_score INTEGER NOT NULL,
+            away_score INTEGER NOT NULL,
+            multiplier REAL DEFAULT 1.0,
+            potential_exact_points INTEGER DEFAULT 100,
+            potential_result_points INTEGER DEFAULT 100,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            points_earned INTEGER DEFAULT NULL,
+            exact_score BOOLEAN DEFAULT FALSE,
+            correct_result BOOLEAN DEFAULT FALSE,
+            league_id INTEGER DEFAULT 1,
+            bet_amount INTEGER DEFAULT 0,
+            outcome_prediction TEXT DEFAULT NULL,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id)
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_player_predictions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            match_id TEXT NOT NULL,
+            player_id TEXT NOT NULL,
+            goals_prediction INTEGER DEFAULT 0,
+            shots_prediction INTEGER DEFAULT 0,
+            minutes_prediction INTEGER DEFAULT 0,
+            multiplier REAL DEFAULT 1.0,
+            potential_points INTEGER DEFAULT 100,
+            points_earned INTEGER DEFAULT NULL,
+            prediction_correct BOOLEAN DEFAULT FALSE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            league_id INTEGER DEFAULT 1,
+            bet_amount INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id)
+        )
+    ''')
+    #League Specific User Scores
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS league_scores (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            league_id INTEGER NOT NULL,
+            score INTEGER DEFAULT 1000,
+            trophies INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id),
+            UNIQUE (user_id, league_id)
+        )
+    ''')
+    # Global league is always id 1
+    c.execute('''
+        INSERT OR IGNORE INTO fantasyLeagues (id, league_name, league_type, privacy, members)
+        VALUES (1, 'Global Ranking', 'classic', 'Public', '')
+    ''')
+
+def _match_predictions(c):
+    # Precomputed AI predictions for upcoming fixtures, refreshed in bulk
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS match_predictions (
+            match_id TEXT PRIMARY KEY,
+            league_code TEXT NOT NULL,
+            season INTEGER NOT NULL,
+            home_expected REAL NOT NULL,
+            away_expected REAL NOT NULL,
+            ai_home_score INTEGER NOT NULL,
+            ai_away_score INTEGER NOT NULL,
+            home_win REAL NOT NULL,
+            draw REAL NOT NULL,
+            away_win REAL NOT NULL,
+            prediction_data TEXT NOT NULL,
+            data_version TEXT NOT NULL,
+            computed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+
+def _league_members(c):
+    # Membership used to be comma-joined usernames in fantasyLeagues.members and league ids in
+    # users.leagues. Those columns are left in place but nothing reads or writes them any more.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS league_members (
+            league_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            joined_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (league_id, user_id),
+            FOREIGN KEY (user_id) REFERENCES users (id),
+            FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id)
+        )
+    ''')
+    # PK covers "who is in league X", this covers "which leagues is user X in"
+    c.execute("CREATE INDEX IF NOT EXISTS idx_league_members_user ON league_members (user_id, league_id)")
+
+    # Copy across from both strings, they weren't always in step with each other
+    c.execute("SELECT id, username FROM users")
+    user_ids = {row[1]: row[0] for row in c.fetchall()}
+    c.execute("SELECT id FROM fantasyLeagues")
+    league_ids = {row[0] for row in c.fetchall()}
+    members = set()
+    c.execute("SELECT id, members FROM fantasyLeagues")
+    for league_id, members_str in c.fetchall():
+        for username in (members_str or "").split(","):
+            if username.strip() in user_ids:
+                members.add((league_id, user_ids[username.strip()]))
+    c.execute("SELECT id, leagues FROM users")
+    for user_id, leagues_str in c.fetchall():
+        for league_id in (leagues_str or "").split(","):
+            if league_id.strip().isdigit() and int(league_id) in league_ids:
+                members.add((int(league_id), user_id))
+    # Everyone with a global score is in the global league
+    c.execute("SELECT user_id FROM league_scores WHERE league_id = 1")
+    members.update((1, row[0]) for row in c.fetchall())
+    c.executemany("INSERT OR IGNORE INTO league_members (league_id, user_id) VALUES (?, ?)", sorted(members))
+
+def _prediction_indexes(c):
+    # Unique keys the upserts look rows up by. Score bets are one per user/match/league, outcome bets
+    # (outcome_prediction set) can be placed more than once so they're left out. Duplicates that got in
+    # through races keep their newest row. The others are moved to *_duplicates tables rather than just
+    # deleted, and their stakes go back to the league score if they were never settled (each one was
+    # debited when it was placed, but only one row per key can ever be settled now).
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_predictions_duplicates AS
+        SELECT * FROM user_predictions
+        WHERE outcome_prediction IS NULL AND id NOT IN (
+            SELECT MAX(id) FROM user_predictions WHERE outcome_prediction IS NULL
+            GROUP BY user_id, match_id, league_id
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_player_predictions_duplicates AS
+        SELECT * FROM user_player_predictions
+        WHERE id NOT IN (
+            SELECT MAX(id) FROM user_player_predictions GROUP BY user_id, match_id, player_id, league_id
+        )
+    ''')
+    for table in ("user_predictions", "user_player_predictions"):
+        c.execute(f'''
+            UPDATE league_scores
+            SET score = score + (
+                SELECT SUM(bet_amount) FROM {table}_duplicates d
+                WHERE d.user_id = league_scores.user_id AND d.league_id = league_scores.league_id
+                  AND d.points_earned IS NULL
+            )
+            WHERE EXISTS (
+                SELECT 1 FROM {table}_duplicates d
+                WHERE d.user_id = league_scores.user_id AND d.league_id = league_scores.league_id
+                  AND d.points_earned IS NULL AND d.bet_amount > 0
+            )
+        ''')
+        c.execute(f"DELETE FROM {table} WHERE id IN (SELECT id FROM {table}_duplicates)")
+    c.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_user_predictions_score_bet
+        ON user_predictions (user_id, match_id, league_id) WHERE outcome_prediction IS NULL
+    ''')
+    c.execute('''
+        CREATE UNIQUE INDEX IF NOT EXISTS uq_user_player_predictions_pick
+        ON user_player_predictions (user_id, match_id, player_id, league_id)
+    ''')
+
+    # A user's bets newest first (get_user_predictions, yourBets)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_predictions_user_created ON user_predictions (user_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_player_predictions_user_created ON user_player_predictions (user_id, created_at)")
+    # Settlement only ever wants unsettled rows, so these stay small however many old bets there are
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_predictions_pending ON user_predictions (match_id) WHERE points_earned IS NULL")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_player_predictions_pending ON user_player_predictions (match_id) WHERE points_earned IS NULL")
+    # Every bet on a match (process_match_bets, newest bet per match in a league)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_predictions_match ON user_predictions (match_id, league_id, created_at)")
+    # League bet feed: group a league's bets by match without touching the table
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_predictions_league_match ON user_predictions (league_id, match_id, created_at)")
+    # Leaderboards and top score in a league
+    c.execute("CREATE INDEX IF NOT EXISTS idx_league_scores_league_score ON league_scores (league_id, score DESC)")
+
+# Body shared by the insert and update triggers on league_scores. Rank is 1 + how many have a higher score
+# (same as RANK()), so a move from old to new score only shifts the people in between by one.
+_SCORE_TRIGGER = '''
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON league_scores
+    WHEN EXISTS (SELECT 1 FROM leaderboard WHERE league_id = NEW.league_id AND user_id = NEW.user_id)
+     AND NOT EXISTS (SELECT 1 FROM leaderboard_bulk WHERE league_id = NEW.league_id)
+    BEGIN
+        UPDATE leaderboard SET rank = rank + 1
+        WHERE league_id = NEW.league_id AND user_id != NEW.user_id
+          AND score >= (SELECT score FROM leaderboard WHERE league_id = NEW.league_id AND user_id = NEW.user_id)
+          AND score < NEW.score;
+        UPDATE leaderboard SET rank = rank - 1
+        WHERE league_id = NEW.league_id AND user_id != NEW.user_id
+          AND score >= NEW.score
+          AND score < (SELECT score FROM leaderboard WHERE league_id = NEW.league_id AND user_id = NEW.user_id);
+        UPDATE leaderboard
+        SET score = NEW.score,
+            trophies = NEW.trophies,
+            rank = 1 + (SELECT COUNT(*) FROM leaderboard o
+                        WHERE o.league_id = NEW.league_id AND o.score > NEW.score AND o.user_id != NEW.user_id)
+        WHERE league_id = NEW.league_id AND user_id = NEW.user_id;
+    END
+'''
+
+def _leaderboard_snapshot(c):
+    # Ranked copy of league_scores per league, kept up to date by triggers in the same transaction as
+    # whatever changed the score, so reads are just a range scan on (league_id, rank).
+    # previous_rank is the rank at the last bulk rebuild (round reset / "flask rebuild-leaderboards").
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            league_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            score INTEGER NOT NULL DEFAULT 0,
+            trophies INTEGER NOT NULL DEFAULT 0,
+            rank INTEGER NOT NULL,
+            previous_rank INTEGER DEFAULT NULL,
+            PRIMARY KEY (league_id, user_id)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leaderboard_rank ON leaderboard (league_id, rank, user_id)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_leaderboard_score ON leaderboard (league_id, score)")
+    # A league with a row in here is being reset in bulk, the triggers leave it alone and the reset
+    # rebuilds it in one go at the end (rather than shuffling ranks once per member)
+    c.execute("CREATE TABLE IF NOT EXISTS leaderboard_bulk (league_id INTEGER PRIMARY KEY)")
+
+    # New member goes in at their score (0 until they have a score row), everyone below moves down one
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS leaderboard_member_added AFTER INSERT ON league_members
+        WHEN NOT EXISTS (SELECT 1 FROM leaderboard_bulk WHERE league_id = NEW.league_id)
+        BEGIN
+            UPDATE leaderboard SET rank = rank + 1
+            WHERE league_id = NEW.league_id
+              AND score < COALESCE((SELECT score FROM league_scores WHERE user_id = NEW.user_id AND league_id = NEW.league_id), 0);
+            INSERT OR REPLACE INTO leaderboard (league_id, user_id, score, trophies, rank)
+            SELECT NEW.league_id, NEW.user_id, COALESCE(s.score, 0), COALESCE(s.trophies, 0),
+                   1 + (SELECT COUNT(*) FROM leaderboard o WHERE o.league_id = NEW.league_id AND o.score > COALESCE(s.score, 0))
+            FROM (SELECT 1) LEFT JOIN league_scores s ON s.user_id = NEW.user_id AND s.league_id = NEW.league_id;
+        END
+    ''')
+    c.execute(_SCORE_TRIGGER.format(name="leaderboard_score_inserted", event="INSERT"))
+    c.execute(_SCORE_TRIGGER.format(name="leaderboard_score_updated", event="UPDATE OF score, trophies"))
+
+    # Fill it for every league that already exists
+    c.execute('''
+        INSERT OR REPLACE INTO leaderboard (league_id, user_id, score, trophies, rank)
+        SELECT m.league_id, m.user_id, COALESCE(s.score, 0), COALESCE(s.trophies, 0),
+               RANK() OVER (PARTITION BY m.league_id ORDER BY COALESCE(s.score, 0) DESC)
+        FROM league_members m
+        LEFT JOIN league_scores s ON s.user_id = m.user_id AND s.league_id = m.league_id
+    ''')
+
+def _member_counts(c):
+    # Counting a league's members meant walking its whole index, which for the global league is every
+    # user. Keep the count on the league instead, triggers bump it as members come and go.
+    c.execute("ALTER TABLE fantasyLeagues ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0")
+    c.execute("UPDATE fantasyLeagues SET member_count = (SELECT COUNT(*) FROM league_members m WHERE m.league_id = fantasyLeagues.id)")
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS league_member_count_added AFTER INSERT ON league_members
+        BEGIN
+            UPDATE fantasyLeagues SET member_count = member_count + 1 WHERE id = NEW.league_id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS league_member_count_removed AFTER DELETE ON league_members
+        BEGIN
+            UPDATE fantasyLeagues SET member_count = member_count - 1 WHERE id = OLD.league_id;
+        END
+    ''')
+
+def _points_ledger(c):
+    # Append-only record of every change to a league_scores balance. Triggers on league_scores write it in
+    # the same transaction as the change, so nothing that touches a score can skip it. Why it changed comes
+    # from the one row in ledger_context, which the code making the change sets first (set_ledger_reason) and
+    # clears before committing. A change made with no row there is logged as an adjustment.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS points_ledger (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            league_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            reference_id TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # A user's history in a league, and the tail after a snapshot
+    c.execute("CREATE INDEX IF NOT EXISTS idx_points_ledger_user_league ON points_ledger (user_id, league_id, id)")
+    # Everything that came from one bet / match / reset
+    c.execute("CREATE INDEX IF NOT EXISTS idx_points_ledger_reference ON points_ledger (reference_id, reason)")
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_context (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            reason TEXT NOT NULL,
+            reference_id TEXT
+        )
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS points_ledger_no_update BEFORE UPDATE ON points_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'points_ledger is append-only');
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS points_ledger_no_delete BEFORE DELETE ON points_ledger
+        BEGIN
+            SELECT RAISE(ABORT, 'points_ledger is append-only');
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS points_ledger_score_inserted AFTER INSERT ON league_scores
+        WHEN COALESCE(NEW.score, 0) != 0
+        BEGIN
+            INSERT INTO points_ledger (user_id, league_id, delta, reason, reference_id)
+            SELECT NEW.user_id, NEW.league_id, NEW.score, COALESCE(x.reason, 'adjustment'), x.reference_id
+            FROM (SELECT 1) LEFT JOIN ledger_context x ON x.id = 1;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS points_ledger_score_updated AFTER UPDATE OF score ON league_scores
+        WHEN COALESCE(NEW.score, 0) != COALESCE(OLD.score, 0)
+        BEGIN
+            INSERT INTO points_ledger (user_id, league_id, delta, reason, reference_id)
+            SELECT NEW.user_id, NEW.league_id, COALESCE(NEW.score, 0) - COALESCE(OLD.score, 0),
+                   COALESCE(x.reason, 'adjustment'), x.reference_id
+            FROM (SELECT 1) LEFT JOIN ledger_context x ON x.id = 1;
+        END
+    ''')
+
+    # Balances at a point in the ledger (everything up to ledger_id), so rebuilding one is the snapshot plus
+    # whatever came after rather than the whole history. "flask snapshot-ledger" adds one.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_snapshots (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ledger_id INTEGER NOT NULL,
+            taken_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_snapshot_balances (
+            snapshot_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            league_id INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            PRIMARY KEY (snapshot_id, user_id, league_id),
+            FOREIGN KEY (snapshot_id) REFERENCES ledger_snapshots (id)
+        )
+    ''')
+
+    # Whatever balances there already are become opening entries
+    c.execute('''
+        INSERT INTO points_ledger (user_id, league_id, delta, reason)
+        SELECT user_id, league_id, score, 'opening balance' FROM league_scores WHERE COALESCE(score, 0) != 0
+    ''')
+
+def _prediction_archive(c):
+    # Settled bets older than the archive horizon move out of the live tables ("flask archive-predictions"),
+    # so settlement, upserts and the league feed only ever see pending and recent rows. Ids are kept (the
+    # live tables are AUTOINCREMENT so they're never reused) and the all_* views put both halves together
+    # for history pages.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_predictions_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            match_id TEXT NOT NULL,
+            home_score INTEGER NOT NULL,
+            away_score INTEGER NOT NULL,
+            multiplier REAL,
+            potential_exact_points INTEGER,
+            potential_result_points INTEGER,
+            created_at TIMESTAMP,
+            points_earned INTEGER,
+            exact_score BOOLEAN,
+            correct_result BOOLEAN,
+            league_id INTEGER,
+            bet_amount INTEGER,
+            outcome_prediction TEXT,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS user_player_predictions_archive (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            match_id TEXT NOT NULL,
+            player_id TEXT NOT NULL,
+            goals_prediction INTEGER,
+            shots_prediction INTEGER,
+            minutes_prediction INTEGER,
+            multiplier REAL,
+            potential_points INTEGER,
+            points_earned INTEGER,
+            prediction_correct BOOLEAN,
+            created_at TIMESTAMP,
+            league_id INTEGER,
+            bet_amount INTEGER,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_predictions_archive_user_created ON user_predictions_archive (user_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_user_player_predictions_archive_user_created ON user_player_predictions_archive (user_id, created_at)")
+    # Column lists spelled out (not models.PREDICTION_COLUMNS) so this migration never changes after the fact
+    c.execute('''
+        CREATE VIEW IF NOT EXISTS all_user_predictions AS
+        SELECT id, user_id, match_id, home_score, away_score, multiplier, potential_exact_points, potential_result_points,
+               created_at, points_earned, exact_score, correct_result, league_id, bet_amount, outcome_prediction
+        FROM user_predictions
+        UNION ALL
+        SELECT id, user_id, match_id, home_score, away_score, multiplier, potential_exact_points, potential_result_points,
+               created_at, points_earned, exact_score, correct_result, league_id, bet_amount, outcome_prediction
+        FROM user_predictions_archive
+    ''')
+    c.execute('''
+        CREATE VIEW IF NOT EXISTS all_user_player_predictions AS
+        SELECT id, user_id, match_id, player_id, goals_prediction, shots_prediction, minutes_prediction, multiplier,
+               potential_points, points_earned, prediction_correct, created_at, league_id, bet_amount
+        FROM user_player_predictions
+        UNION ALL
+        SELECT id, user_id, match_id, player_id, goals_prediction, shots_prediction, minutes_prediction, multiplier,
+               potential_points, points_earned, prediction_correct, created_at, league_id, bet_amount
+        FROM user_player_predictions_archive
+    ''')
+
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "match_predictions", _match_predictions),
+    (3, "league_members", _league_members),
+    (4, "prediction indexes", _prediction_indexes),
+    (5, "leaderboard snapshot", _leaderboard_snapshot),
+    (6, "league member counts", _member_counts),
+    (7, "points ledger", _points_ledger),
+    (8, "prediction archive", _prediction_archive),
+]
+
+def get_schema_version(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    c.execute("SELECT MAX(version) FROM schema_migrations")
+    return c.fetchone()[0] or 0
+
+def migrate():
+    """Apply any migrations the database doesn't have yet. Returns the list of versions applied."""
+    conn = get_db_connection()
+    applied = []
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            # IMMEDIATE takes the write lock first, so two workers starting together can't both migrate
+            c.execute("BEGIN IMMEDIATE")
+            current = get_schema_version(c)
+            for version, name, apply in MIGRATIONS:
+                if version <= current:
+                    continue
+                apply(c)
+                c.execute("INSERT INTO schema_migrations (version, name) VALUES (?, ?)", (version, name))
+                applied.append(version)
+            conn.commit()
+            for version in applied:
+                print(f"Applied migration {version}")
+        except Error as e:
+            # All or nothing, next start tries again
+            print(f"Error migrating database: {e}")
+            conn.rollback()
+            applied = []
+        finally:
+            conn.close()
+    return applied
@@ -1,125 +1,23 @@
-import sqlite3
 from sqlite3 import Error
 from werkzeug.security import generate_password_hash, check_password_hash
 import random
 import string
 from datetime import datetime, timedelta
-import aiohttp
-import asyncio
+import json
+from .understat_client import get_understat_client
+from .db import get_pool
 
 
 DATABASE = 'scoracle.db'
 
 def get_db_connection():
-    """Create a database connection."""
+    """Get a pooled database connection (WAL, see db.py). Within a request it's the same one every time, close() just hands it back."""
     try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        return conn
+        return get_pool(DATABASE).connection()
     except Error as e:
         print(f"Error connecting to database: {e}")
         return None
 
-def init_db():
-    """Initialize the database with the users table."""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            # Create users table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS users (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    username TEXT UNIQUE NOT NULL,
-                    password_hash TEXT NOT NULL,
-                    leagues TEXT DEFAULT '',
-                    favourite_team TEXT DEFAULT '',
-                    profile_pic TEXT NOT NULL DEFAULT 'login.png',
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            ''')
-            # fantasy league table
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS fantasyLeagues (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    league_name TEXT NOT NULL,
-                    league_type TEXT CHECK(league_type IN ('classic', 'seasonal')) NOT NULL,
-                    privacy TEXT CHECK(privacy IN ('Public', 'Private')) NOT NULL,
-                    league_code TEXT UNIQUE,
-                    members TEXT DEFAULT '',
-                    creator TEXT,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    season_end TIMESTAMP DEFAULT NULL
-                )
-            ''')
-            # User predictions
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS user_predictions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    match_id TEXT NOT NULL,
-                    home_score INTEGER NOT NULL,
-                    away_score INTEGER NOT NULL,
-                    multiplier REAL DEFAULT 1.0,
-                    potential_exact_points INTEGER DEFAULT 100,
-                    potential_result_points INTEGER DEFAULT 100,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    points_earned INTEGER DEFAULT NULL,
-                    exact_score BOOLEAN DEFAULT FALSE,
-                    correct_result BOOLEAN DEFAULT FALSE,
-                    league_id INTEGER DEFAULT 1,
-                    bet_amount INTEGER DEFAULT 0,
-                    outcome_prediction TEXT DEFAULT NULL,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id)
-                )
-            ''')
-            
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS user_player_predictions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    match_id TEXT NOT NULL,
-                    player_id TEXT NOT NULL,
-                    goals_prediction INTEGER DEFAULT 0,
-                    shots_prediction INTEGER DEFAULT 0,
-                    minutes_prediction INTEGER DEFAULT 0,
-                    multiplier REAL DEFAULT 1.0,
-                    potential_points INTEGER DEFAULT 100,
-                    points_earned INTEGER DEFAULT NULL,
-                    prediction_correct BOOLEAN DEFAULT FALSE,
-                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    league_id INTEGER DEFAULT 1,
-                    bet_amount INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id)
-                )
-            ''')
-            
-            #League Specific User Scores
-            c.execute('''
-                CREATE TABLE IF NOT EXISTS league_scores (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    user_id INTEGER NOT NULL,
-                    league_id INTEGER NOT NULL,
-                    score INTEGER DEFAULT 1000,
-                    trophies INTEGER DEFAULT 0,
-                    FOREIGN KEY (user_id) REFERENCES users (id),
-                    FOREIGN KEY (league_id) REFERENCES fantasyLeagues (id),
-                    UNIQUE (user_id, league_id)
-                )
-            ''')
-            conn.commit()
-            
-            # Create global league
-            ensure_global_league_exists()
-            
-        except Error as e:
-            print(f"Error creating database: {e}")
-        finally:
-            conn.close()
-
 def add_user(username, password):
     """Add a new user to the database."""
     conn = get_db_connection()
@@ -216,65 +114,34 @@ def user_exists(username):
     return False
 
 """ USER PREDICTIONS FOR GAME SCORES"""
-def save_prediction(user_id, match_id, home_score, away_score, bet_amount, outcome_prediction, multiplier=1.0, potential_exact_points=100, potential_result_points=100):
-    """Save or update a user's prediction for a match. outcome prediction is for win/loss bets. score predicting bets leave it null."""
-    import traceback
-    print(f"DEBUG save_prediction: user_id={user_id}, match_id={match_id}, scores={home_score}-{away_score}")
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            # Check if prediction already exists
-            c.execute('SELECT id FROM user_predictions WHERE user_id = ? AND match_id = ?',
-                     (user_id, match_id))
-            existing = c.fetchone()
-            
-            print(f"DEBUG: Existing prediction found? {bool(existing)}")
-            
-            if existing:
-                # Update
-                print(f"DEBUG: Updating prediction with ID: {existing[0]}")
-                update_sql = '''
-                    UPDATE user_predictions 
-                    SET home_score = ?, away_score = ?, bet_amount = ?, outcome_prediction = ?, multiplier = ?, potential_exact_points = ?, potential_result_points = ?, created_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                '''
-                params = (home_score, away_score, bet_amount, outcome_prediction, multiplier, potential_exact_points, potential_result_points, existing[0])
-                print(f"DEBUG: SQL: {update_sql}")
-                print(f"DEBUG: Params: {params}")
-                c.execute(update_sql, params)
-            else:
-                # Insert with all fields
-                insert_sql = '''
-                    INSERT INTO user_predictions
-                    (user_id, match_id, home_score, away_score, bet_amount, outcome_prediction, multiplier, potential_exact_points, potential_result_points)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                '''
-                params = (user_id, match_id, home_score, away_score, bet_amount, outcome_prediction, multiplier, potential_exact_points, potential_result_points)
-                print(f"DEBUG: SQL: {insert_sql}")
-                print(f"DEBUG: Params: {params}")
-                c.execute(insert_sql, params)
-            
-            conn.commit()
-            print("DEBUG: Database committed successfully")
-            return True
-        except Exception as e:
-            print(f"ERROR saving prediction: {e}")
-            print(traceback.format_exc())
-            return False
-        finally:
-            conn.close()
-    print("ERROR: Could not get database connection")
-    return False
-
-def get_user_predictions(user_id, limit=10):
-    """Get the most recent predictions for a user."""
+# Bets are written by place_bet (BET LEDGER below) with these two statements
+# One score bet per user/match/league (uq_user_predictions_score_bet), placing it again updates it
+SCORE_BET_UPSERT = '''
+    INSERT INTO user_predictions
+    (user_id, match_id, home_score, away_score, bet_amount, outcome_prediction, multiplier, potential_exact_points, potential_result_points, league_id)
+    VALUES (?, ?, ?, ?, ?, NULL, ?, ?, ?, ?)
+    ON CONFLICT (user_id, match_id, league_id) WHERE outcome_prediction IS NULL DO UPDATE SET
+        home_score = excluded.home_score, away_score = excluded.away_score, bet_amount = excluded.bet_amount,
+        multiplier = excluded.multiplier, potential_exact_points = excluded.potential_exact_points,
+        potential_result_points = excluded.potential_result_points, created_at = CURRENT_TIMESTAMP
+'''
+# Outcome bets can be placed more than once
+OUTCOME_BET_INSERT = '''
+    INSERT INTO user_predictions
+    (user_id, match_id, home_score, away_score, bet_amount, outcome_prediction, multiplier, potential_exact_points, potential_result_points, league_id)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+def get_user_predictions(user_id, limit=10, include_archived=False):
+    """Get the most recent predictions for a user. include_archived for history pages, otherwise it's
+    only the live table (pending and recently settled bets)."""
+    table = "all_user_predictions" if include_archived else "user_predictions"
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            c.execute('''
-                SELECT * FROM user_predictions
+            c.execute(f'''
+                SELECT * FROM {table}
                 WHERE user_id = ?
                 ORDER BY created_at DESC
                 LIMIT ?
@@ -288,55 +155,9 @@ def get_user_predictions(user_id, limit=10):
             conn.close()
     return []
 
-def save_player_prediction(user_id, match_id, player_id, goals_prediction, shots_prediction, minutes_prediction=0, 
-                         multiplier=1.0, potential_points=100):
-    """Save or update a user's player prediction."""
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            # Check if prediction already exists
-            c.execute('''SELECT id FROM user_player_predictions 
-                         WHERE user_id = ? AND match_id = ? AND player_id = ?''',
-                     (user_id, match_id, player_id))
-            existing = c.fetchone()
-            
-            if existing:
-                # Update
-                update_sql = '''
-                    UPDATE user_player_predictions 
-                    SET goals_prediction = ?, shots_prediction = ?, minutes_prediction = ?,
-                        multiplier = ?, potential_points = ?, created_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                '''
-                params = (goals_prediction, shots_prediction, minutes_prediction,
-                         multiplier, potential_points, existing[0])
-                c.execute(update_sql, params)
-            else:
-                # Insert new prediction
-                insert_sql = '''
-                    INSERT INTO user_player_predictions
-                    (user_id, match_id, player_id, goals_prediction, shots_prediction, 
-                     minutes_prediction, multiplier, potential_points)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                '''
-                params = (user_id, match_id, player_id, goals_prediction, shots_prediction,
-                         minutes_prediction, multiplier, potential_points)
-                c.execute(insert_sql, params)
-            
-            conn.commit()
-            return True
-        except Exception as e:
-            print(f"ERROR saving player prediction: {e}")
-            import traceback
-            print(traceback.format_exc())
-            return False
-        finally:
-            conn.close()
-    return False
-
-def get_user_player_predictions(user_id, match_id=None):
-    """Get player predictions for a user, optionally filtered by match."""
+def get_user_player_predictions(user_id, match_id=None, include_archived=False):
+    """Get player predictions for a user, optionally filtered by match. include_archived as for get_user_predictions."""
+    table = "all_user_player_predictions" if include_archived else "user_player_predictions"
     conn = get_db_connection()
     if conn is not None:
         try:
@@ -344,15 +165,15 @@ def get_user_player_predictions(user_id, match_id=None):
             
             if match_id:
                 # Get predictions for  match
-                c.execute('''
-                    SELECT * FROM user_player_predictions
+                c.execute(f'''
+                    SELECT * FROM {table}
                     WHERE user_id = ? AND match_id = ?
                     ORDER BY created_at DESC
                 ''', (user_id, match_id))
             else:
                 # Get all player predictions
-                c.execute('''
-                    SELECT * FROM user_player_predictions
+                c.execute(f'''
+                    SELECT * FROM {table}
                     WHERE user_id = ?
                     ORDER BY created_at DESC
                 ''', (user_id,))
@@ -367,6 +188,65 @@ def get_user_player_predictions(user_id, match_id=None):
     return []
 
 
+""" PRECOMPUTED MATCH PREDICTIONS"""
+def save_match_predictions(predictions):
+    """Insert or replace PredictionSystem output (predict_match / predict_matchday) for many matches at once."""
+    if not predictions:
+        return 0
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            rows = [
+                (str(p["match"]["id"]), p["league_code"], p["season"], p["home_expected"], p["away_expected"],
+                 p["prediction"]["home"], p["prediction"]["away"], p["probabilities"]["home_win"],
+                 p["probabilities"]["draw"], p["probabilities"]["away_win"], json.dumps(p), p["data_version"])
+                for p in predictions
+            ]
+            c.executemany('''
+                INSERT INTO match_predictions
+                (match_id, league_code, season, home_expected, away_expected, ai_home_score, ai_away_score,
+                 home_win, draw, away_win, prediction_data, data_version, computed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(match_id) DO UPDATE SET
+                    league_code = excluded.league_code, season = excluded.season,
+                    home_expected = excluded.home_expected, away_expected = excluded.away_expected,
+                    ai_home_score = excluded.ai_home_score, ai_away_score = excluded.ai_away_score,
+                    home_win = excluded.home_win, draw = excluded.draw, away_win = excluded.away_win,
+                    prediction_data = excluded.prediction_data, data_version = excluded.data_version,
+                    computed_at = CURRENT_TIMESTAMP
+            ''', rows)
+            conn.commit()
+            return len(rows)
+        except Error as e:
+            print(f"Error saving match predictions: {e}")
+            return 0
+        finally:
+            conn.close()
+    return 0
+
+def get_match_prediction(match_id, max_age_hours=6):
+    """Get the stored prediction for a match in the same shape predict_match returns, or None if missing or too old."""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            c.execute('''
+                SELECT prediction_data FROM match_predictions
+                WHERE match_id = ? AND computed_at >= datetime('now', ?)
+            ''', (str(match_id), f"-{int(max_age_hours)} hours"))
+            row = c.fetchone()
+            if row:
+                return json.loads(row[0])
+            return None
+        except Error as e:
+            print(f"Error getting match prediction: {e}")
+            return None
+        finally:
+            conn.close()
+    return None
+
+
 """FANTASY LEAGUE"""
 
 def add_fantasy_league(league_name, league_type, privacy, username):
@@ -376,10 +256,16 @@ def add_fantasy_league(league_name, league_type, privacy, username):
         try:
             league_code = generate_league_code() if privacy == "Private" else None
             c = conn.cursor()
+            c.execute("SELECT id FROM users WHERE username = ?", (username,))
+            user_row = c.fetchone()
+            if not user_row:
+                return False
+            user_id = user_row[0]
+
             c.execute('''
-                INSERT INTO fantasyLeagues (league_name, league_type, privacy, league_code, members, creator, season_end)
-                VALUES (?, ?, ?, ?, ?, ?, null)
-            ''', (league_name, league_type, privacy, league_code, str(username), str(username)))
+                INSERT INTO fantasyLeagues (league_name, league_type, privacy, league_code, creator, season_end)
+                VALUES (?, ?, ?, ?, ?, null)
+            ''', (league_name, league_type, privacy, league_code, str(username)))
             league_id = c.lastrowid
             
             #set league end for 1 week from creation
@@ -391,19 +277,12 @@ def add_fantasy_league(league_name, league_type, privacy, username):
                     WHERE id = ?
                 ''', (season_end, league_id))
 
-            # Update the creator's leagues column
-            c.execute("SELECT leagues FROM users WHERE username = ?", (username,))
-            user_leagues = c.fetchone()[0]
-            updated_leagues = f"{user_leagues},{league_id}".strip(",")
-            c.execute("UPDATE users SET leagues = ? WHERE username = ?", (updated_leagues, username))
-            
-            # Insert the creator into league_scores with a starting score of 1000
-            c.execute("SELECT id FROM users WHERE username = ?", (username,))
-            user_row = c.fetchone()
-            if user_row:
-                user_id = user_row[0]
-                c.execute("INSERT INTO league_scores (user_id, league_id, score) VALUES (?, ?, 1000)", (user_id, league_id))
+            # Creator is the first member, starting on 1000
+            c.execute("INSERT INTO league_members (league_id, user_id) VALUES (?, ?)", (league_id, user_id))
+            set_ledger_reason(c, "join", league_id)
+            c.execute("INSERT INTO league_scores (user_id, league_id, score) VALUES (?, ?, 1000)", (user_id, league_id))
             
+            clear_ledger_reason(c)
             conn.commit()
             return league_code if league_code else True
         except Error as e:
@@ -450,20 +329,34 @@ def get_league_by_id(league_id):
             conn.close()
     return None
 
+def get_league_names():
+    """{league id: league name} for every league, yourBets labels bets with it"""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            c.execute("SELECT id, league_name FROM fantasyLeagues")
+            return {row[0]: row[1] for row in c.fetchall()}
+        except Error as e:
+            print(f"Error fetching league names: {e}")
+            return {}
+        finally:
+            conn.close()
+    return {}
+
 def get_public_leagues():
-    """Fetch all public fantasy leagues with creator names."""
+    """Fetch all public fantasy leagues with creator names and member counts."""
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
             c.execute("""
-                SELECT f.id, f.league_name, f.league_type, f.privacy, f.members, f.created_at, u.username as creator
+                SELECT f.id, f.league_name, f.league_type, f.privacy, f.created_at, COALESCE(f.creator, '') AS creator, f.member_count
                 FROM fantasyLeagues f
-                JOIN users u ON f.members LIKE u.username || '%'  -- Get the first user in the members list
                 WHERE f.privacy = 'Public'
             """)
             leagues = c.fetchall()
-            return [{"id": row[0], "name": row[1], "league_type": row[2], "members": row[4], "created_at": row[5], "creator": row[6]} for row in leagues]
+            return [{"id": row[0], "name": row[1], "league_type": row[2], "created_at": row[4], "creator": row[5], "member_count": row[6]} for row in leagues]
         except Error as e:
             print(f"Error fetching public leagues: {e}")
             return []
@@ -481,26 +374,14 @@ def get_user_leagues(username):
     if conn is not None:
         try:
             c = conn.cursor()
-            c.execute("SELECT leagues FROM users WHERE username = ?", (username,))
-            result = c.fetchone()
-
-            if not result or not result[0]:
-                return []
-
-            league_ids = [int(x.strip()) for x in result[0].split(",") if x.strip()]
-
-            if not league_ids:
-                return []
-
-            placeholders = ",".join(["?"] * len(league_ids))
-
-            query = f"""
-                SELECT f.id, f.league_name, f.league_type, f.privacy, f.members, f.created_at, u.username as creator
-                FROM fantasyLeagues f
-                JOIN users u ON f.members LIKE u.username || '%'
-                WHERE f.id IN ({placeholders})
-            """
-            c.execute(query, league_ids)
+            c.execute("""
+                SELECT f.id, f.league_name, f.league_type, f.privacy, f.created_at, COALESCE(f.creator, '') AS creator, f.member_count
+                FROM users u
+                JOIN league_members m ON m.user_id = u.id
+                JOIN fantasyLeagues f ON f.id = m.league_id
+                WHERE u.username = ?
+                ORDER BY m.joined_at, f.id
+            """, (username,))
             rows = c.fetchall()
 
             user_leagues = [
@@ -509,9 +390,9 @@ def get_user_leagues(username):
                     "name": row[1],
                     "league_type": row[2],
                     "privacy": row[3],
-                    "members": row[4],
-                    "created_at": row[5],
-                    "creator": row[6]
+                    "created_at": row[4],
+                    "creator": row[5],
+                    "member_count": row[6]
                 }
                 for row in rows
             ]
@@ -530,14 +411,12 @@ def is_user_in_league(username, league_id):
     if conn is not None:
         try:
             c = conn.cursor()
-            c.execute("SELECT members FROM fantasyLeagues WHERE id = ?", (league_id,))
-            result = c.fetchone()
-
-            if result and result[0]:
-                members = result[0].split(",")
-                return username in members
-
-            return False
+            c.execute("""
+                SELECT 1 FROM league_members m
+                JOIN users u ON u.id = m.user_id
+                WHERE u.username = ? AND m.league_id = ?
+            """, (username, league_id))
+            return c.fetchone() is not None
         except Error as e:
             print(f"Error checking if user is in league: {e}")
             return False
@@ -545,8 +424,29 @@ def is_user_in_league(username, league_id):
             conn.close()
     return False
 
+def get_league_members(league_id, limit=-1):
+    """Usernames in a league, in the order they joined. limit=-1 is everyone"""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            c.execute("""
+                SELECT u.username FROM league_members m
+                JOIN users u ON u.id = m.user_id
+                WHERE m.league_id = ?
+                ORDER BY m.joined_at, m.user_id
+                LIMIT ?
+            """, (league_id, limit))
+            return [row[0] for row in c.fetchall()]
+        except Error as e:
+            print(f"Error fetching league members: {e}")
+            return []
+        finally:
+            conn.close()
+    return []
+
 def add_user_to_league(username, league_id):
-    """Add a user to a league and ensure they have a score entry, updating the user's leagues column."""
+    """Add a user to a league and ensure they have a score entry."""
     conn = get_db_connection()
     if conn is not None:
         try:
@@ -559,23 +459,12 @@ def add_user_to_league(username, league_id):
                 return False
             user_id = user_row[0]
 
-            # Update league members list
-            c.execute("SELECT members FROM fantasyLeagues WHERE id = ?", (league_id,))
-            members_row = c.fetchone()
-            members = members_row[0].split(",") if members_row and members_row[0] else []
-            if username in members:
-                return False 
-            members.append(username)
-            updated_members = ",".join(members)
-            c.execute("UPDATE fantasyLeagues SET members = ? WHERE id = ?", (updated_members, league_id))
-
-            # Update user's leagues column
-            c.execute("SELECT leagues FROM users WHERE username = ?", (username,))
-            user_leagues_row = c.fetchone()
-            user_leagues = user_leagues_row[0] if user_leagues_row and user_leagues_row[0] else ""
-            updated_user_leagues = f"{user_leagues},{league_id}".strip(",")
-            c.execute("UPDATE users SET leagues = ? WHERE username = ?", (updated_user_leagues, username))
+            # Nothing inserted = already a member
+            c.execute("INSERT OR IGNORE INTO league_members (league_id, user_id) VALUES (?, ?)", (league_id, user_id))
+            if c.rowcount == 0:
+                return False
 
+            set_ledger_reason(c, "join", league_id)
             # Check if a league_scores row exists
             c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = ?", (user_id, league_id))
             existing = c.fetchone()
@@ -588,6 +477,7 @@ def add_user_to_league(username, league_id):
                 c.execute("UPDATE league_scores SET score = 1000 WHERE user_id = ? AND league_id = ?", 
                           (user_id, league_id))
 
+            clear_ledger_reason(c)
             conn.commit()
             return True
         except Error as e:
@@ -598,92 +488,168 @@ def add_user_to_league(username, league_id):
     return False
 
 
-def get_league_leaderboard(league_id):
-    """Fetch the leaderboard for a specific league"""
+LEADERBOARD_PAGE_SIZE = 50
+
+# Reads come from the leaderboard snapshot table (migration 5), which triggers keep ranked as scores change.
+# Ties share a rank, then it's join order by user id. Params: league_id x2, limit, offset
+LEADERBOARD_QUERY = """
+    SELECT u.username, l.score, l.trophies, l.rank, l.previous_rank,
+           (SELECT member_count FROM fantasyLeagues WHERE id = ?) AS total
+    FROM leaderboard l
+    JOIN users u ON u.id = l.user_id
+    WHERE l.league_id = ?
+    ORDER BY l.rank, l.user_id
+    LIMIT ? OFFSET ?
+"""
+
+def leaderboard_entry(row):
+    # movement: places gained since the last rebuild, + is up
+    movement = row["previous_rank"] - row["rank"] if row["previous_rank"] is not None else None
+    return {"rank": row["rank"], "username": row["username"], "score": row["score"], "trophies": row["trophies"],
+            "previous_rank": row["previous_rank"], "movement": movement}
+
+def get_league_leaderboard(league_id, page=1, per_page=LEADERBOARD_PAGE_SIZE, username=None):
+    """One page of a league's leaderboard. Returns {"leaderboard", "total", "page", "per_page",
+    "pages", "my_rank"} where my_rank is username's own row (or None) even if it's not on this page."""
+    page = max(int(page or 1), 1)
+    empty = {"leaderboard": [], "total": 0, "page": page, "per_page": per_page, "pages": 0, "my_rank": None}
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            
-            # Get all members of the league
-            c.execute("SELECT members FROM fantasyLeagues WHERE id = ?", (league_id,))
-            members_str = c.fetchone()
-            if not members_str or not members_str[0]:
-                return []
-
-            member_list = [x.strip() for x in members_str[0].split(",") if x.strip()]
-
-            # Fetch user IDs for these members
-            placeholders = ','.join(['?'] * len(member_list))
-            c.execute(f"SELECT id, username FROM users WHERE username IN ({placeholders})", member_list)
-            users = {row[0]: row[1] for row in c.fetchall()}  # Dict {user_id: username}
-
-            # Fetch existing scores from league_scores
-            c.execute("SELECT user_id, score FROM league_scores WHERE league_id = ?", (league_id,))
-            existing_scores = {row[0]: row[1] for row in c.fetchall()}  # Dict {user_id: score}
-
-            # Build the leaderboard
-            leaderboard = []
-            for user_id, username in users.items():
-                score = existing_scores.get(user_id, 0)  # Default to 0 if no score exists
-                leaderboard.append({"username": username, "score": score})
-
-            # Sort by score (highest first)
-            leaderboard.sort(key=lambda x: x["score"], reverse=True)
-
-            return leaderboard
+            c.execute(LEADERBOARD_QUERY, (league_id, league_id, per_page, (page - 1) * per_page))
+            rows = c.fetchall()
+            if rows:
+                total = rows[0]["total"]
+            else:
+                # Past the last page, still say how many there are
+                c.execute("SELECT member_count FROM fantasyLeagues WHERE id = ?", (league_id,))
+                row = c.fetchone()
+                total = row[0] if row else 0
+            leaderboard = [leaderboard_entry(row) for row in rows]
+
+            my_rank = next((entry for entry in leaderboard if entry["username"] == username), None)
+            if username and my_rank is None:
+                c.execute("""
+                    SELECT u.username, l.score, l.trophies, l.rank, l.previous_rank
+                    FROM users u
+                    JOIN leaderboard l ON l.user_id = u.id AND l.league_id = ?
+                    WHERE u.username = ?
+                """, (league_id, username))
+                row = c.fetchone()
+                my_rank = leaderboard_entry(row) if row else None
+
+            return {
+                "leaderboard": leaderboard,
+                "total": total,
+                "page": page,
+                "per_page": per_page,
+                "pages": (total + per_page - 1) // per_page,
+                "my_rank": my_rank
+            }
         except Error as e:
             print(f"Error fetching leaderboard: {e}")
-            return []
+            return empty
         finally:
             conn.close()
-    return []
+    return empty
 
-def get_seasonal_league_leaderboard(league_id):
-    """Fetch the leaderboard for a specific seasonal league"""
+def get_user_rank(league_id, username, neighbours=2):
+    """Where one user stands in a league without ranking everyone: their row off the snapshot's primary key,
+    the member count off the league and `neighbours` places either side off the (league_id, rank) index.
+    Returns {"rank", "score", "trophies", "movement", "total", "percentile", "above", "below"} or None."""
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            
-            # Get all members of the league
-            c.execute("SELECT members FROM fantasyLeagues WHERE id = ?", (league_id,))
-            members_str = c.fetchone()
-            if not members_str or not members_str[0]:
-                return []
-
-            member_list = [x.strip() for x in members_str[0].split(",") if x.strip()]
-
-            # Fetch user IDs for these members
-            placeholders = ','.join(['?'] * len(member_list))
-            c.execute(f"SELECT id, username FROM users WHERE username IN ({placeholders})", member_list)
-            users = {row[0]: row[1] for row in c.fetchall()}  # Dict {user_id: username}
-
-            # Fetch existing scores from league_scores
-            c.execute("SELECT user_id, score FROM league_scores WHERE league_id = ?", (league_id,))
-            existing_scores = {row[0]: row[1] for row in c.fetchall()}  # Dict {user_id: score}
-            
-            # Fetch existing trophies from league_scores
-            c.execute("SELECT user_id, trophies FROM league_scores WHERE league_id = ?", (league_id,))
-            existing_trophies = {row[0]: row[1] for row in c.fetchall()}  # Dict {user_id: trophies}
-
-            # Build the leaderboard
-            leaderboard = []
-            for user_id, username in users.items():
-                score = existing_scores.get(user_id, 0)
-                trophies = existing_trophies.get(user_id, 0) 
-                leaderboard.append({"username": username, "score": score, "trophies": trophies})
-
-            # Sort by score (highest first)
-            leaderboard.sort(key=lambda x: x["score"], reverse=True)
+            c.execute("""
+                SELECT u.id, u.username, l.score, l.trophies, l.rank, l.previous_rank, f.member_count
+                FROM users u
+                JOIN leaderboard l ON l.user_id = u.id AND l.league_id = ?
+                JOIN fantasyLeagues f ON f.id = l.league_id
+                WHERE u.username = ?
+            """, (league_id, username))
+            me = c.fetchone()
+            if not me:
+                return None
+
+            # Same order as the leaderboard pages: rank, then user id for ties
+            c.execute("""
+                SELECT u.username, l.score, l.trophies, l.rank, l.previous_rank
+                FROM leaderboard l JOIN users u ON u.id = l.user_id
+                WHERE l.league_id = ? AND (l.rank, l.user_id) < (?, ?)
+                ORDER BY l.rank DESC, l.user_id DESC
+                LIMIT ?
+            """, (league_id, me["rank"], me["id"], neighbours))
+            above = [leaderboard_entry(row) for row in reversed(c.fetchall())]
+            c.execute("""
+                SELECT u.username, l.score, l.trophies, l.rank, l.previous_rank
+                FROM leaderboard l JOIN users u ON u.id = l.user_id
+                WHERE l.league_id = ? AND (l.rank, l.user_id) > (?, ?)
+                ORDER BY l.rank, l.user_id
+                LIMIT ?
+            """, (league_id, me["rank"], me["id"], neighbours))
+            below = [leaderboard_entry(row) for row in c.fetchall()]
+
+            total = me["member_count"]
+            entry = leaderboard_entry(me)
+            entry.update({
+                "total": total,
+                # Share of the league ranked the same or below you, 100 = top
+                "percentile": round(100 * (total - me["rank"] + 1) / total, 1) if total else None,
+                "above": above,
+                "below": below
+            })
+            return entry
+        except Error as e:
+            print(f"Error fetching rank for {username} in league {league_id}: {e}")
+            return None
+        finally:
+            conn.close()
+    return None
 
-            return leaderboard
+def rebuild_leaderboard(c, league_id):
+    """Re-rank a league's snapshot from league_scores in one statement. The ranks it had become previous_rank."""
+    c.execute("""
+        INSERT INTO leaderboard (league_id, user_id, score, trophies, rank, previous_rank)
+        SELECT m.league_id, m.user_id, COALESCE(s.score, 0), COALESCE(s.trophies, 0),
+               RANK() OVER (ORDER BY COALESCE(s.score, 0) DESC), old.rank
+        FROM league_members m
+        LEFT JOIN league_scores s ON s.user_id = m.user_id AND s.league_id = m.league_id
+        LEFT JOIN leaderboard old ON old.league_id = m.league_id AND old.user_id = m.user_id
+        WHERE m.league_id = ?
+        ON CONFLICT (league_id, user_id) DO UPDATE SET
+            score = excluded.score, trophies = excluded.trophies,
+            rank = excluded.rank, previous_rank = excluded.previous_rank
+    """, (league_id,))
+
+def begin_leaderboard_bulk(c, league_id):
+    """Call before changing every score in a league, the triggers skip it until finish_leaderboard_bulk"""
+    c.execute("INSERT OR IGNORE INTO leaderboard_bulk (league_id) VALUES (?)", (league_id,))
+
+def finish_leaderboard_bulk(c, league_id):
+    """Rebuild the league's snapshot once and turn the triggers back on. Same transaction as the changes."""
+    rebuild_leaderboard(c, league_id)
+    c.execute("DELETE FROM leaderboard_bulk WHERE league_id = ?", (league_id,))
+
+def rebuild_all_leaderboards():
+    """Re-rank every league, e.g. nightly so movement is since yesterday. Returns how many leagues."""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            c.execute("SELECT id FROM fantasyLeagues")
+            league_ids = [row[0] for row in c.fetchall()]
+            for league_id in league_ids:
+                rebuild_leaderboard(c, league_id)
+            conn.commit()
+            return len(league_ids)
         except Error as e:
-            print(f"Error fetching leaderboard: {e}")
-            return []
+            print(f"Error rebuilding leaderboards: {e}")
+            return 0
         finally:
             conn.close()
-    return []
+    return 0
 
 
 def end_seasonal_round(league_id):
@@ -706,6 +672,8 @@ def end_seasonal_round(league_id):
                 return False
 
             max_score = max_score_result[0]
+            begin_leaderboard_bulk(c, league_id)
+            set_ledger_reason(c, "round reset", league_id)
 
             #Award trophies to all users with top score
             c.execute("""
@@ -722,6 +690,9 @@ def end_seasonal_round(league_id):
                 WHERE league_id = ?
             """, (league_id,))
 
+            # Re-rank everyone once, previous_rank keeps where they finished the round
+            finish_leaderboard_bulk(c, league_id)
+
             # Set the new season_end to one week from now
             new_end_dt = datetime.now() + timedelta(weeks=1)
             new_end_str = new_end_dt.strftime("%Y-%m-%d %H:%M:%S")
@@ -731,6 +702,7 @@ def end_seasonal_round(league_id):
                 WHERE id = ?
             """, (new_end_str, league_id))
 
+            clear_ledger_reason(c)
             conn.commit()
             return True
         except Error as e:
@@ -741,12 +713,13 @@ def end_seasonal_round(league_id):
     return False
 
 
-def update_league_score(user_id, league_id, points):
-    """Update a user's score in a specific league."""
+def update_league_score(user_id, league_id, points, reason="adjustment", reference_id=None):
+    """Update a user's score in a specific league. reason/reference_id end up in the points ledger."""
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
+            set_ledger_reason(c, reason, reference_id)
 
             # Check if the user already has a score in this league
             c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = ?", (user_id, league_id))
@@ -762,6 +735,7 @@ def update_league_score(user_id, league_id, points):
                 c.execute("INSERT INTO league_scores (user_id, league_id, score) VALUES (?, ?, ?)", 
                           (user_id, league_id, points))
 
+            clear_ledger_reason(c)
             conn.commit()
             return True
         except Error as e:
@@ -771,50 +745,278 @@ def update_league_score(user_id, league_id, points):
             conn.close()
     return False
 
-def place_bet(user_id, league_id, match_id, bet_amount, outcome_prediction=None, home_score=0, away_score=0):
-    """ Place a bet by saving it in the unified user_predictions table. """
-    
+'''POINTS LEDGER'''
+# points_ledger (migration 7) gets a row from triggers whenever a league_scores balance changes, in the
+# same transaction. Anything that changes a score calls set_ledger_reason first so the rows say why, and
+# clear_ledger_reason before it commits (same as begin/finish_leaderboard_bulk).
+LEDGER_SNAPSHOTS_KEPT = 8
+
+def set_ledger_reason(c, reason, reference_id=None):
+    """Label the score changes that follow on this transaction, e.g. ("bet", match_id) or ("settlement", prediction id)"""
+    c.execute("INSERT OR REPLACE INTO ledger_context (id, reason, reference_id) VALUES (1, ?, ?)",
+              (reason, None if reference_id is None else str(reference_id)))
+
+def clear_ledger_reason(c):
+    """Drop the label before committing, so a later change nobody labelled is logged as an 'adjustment'
+    instead of under this transaction's reason"""
+    c.execute("DELETE FROM ledger_context")
+
+def get_points_history(user_id, league_id, limit=50):
+    """A user's ledger entries in a league, newest first"""
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            
-            # Check if the user has enough points
-            c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = ?", (user_id, league_id))
-            user_score = c.fetchone()
-            if not user_score or user_score[0] < bet_amount:
-                return {"success": False, "message": "Insufficient points to place bet"}
-            
-            # Deduct the bet amount from the user's score
-            new_score = user_score[0] - bet_amount
-            c.execute("UPDATE league_scores SET score = ? WHERE user_id = ? AND league_id = ?", 
-                      (new_score, user_id, league_id))
-            
-            # Decide which type of bet this is
+            c.execute("""
+                SELECT id, delta, reason, reference_id, created_at FROM points_ledger
+                WHERE user_id = ? AND league_id = ? ORDER BY id DESC LIMIT ?
+            """, (user_id, league_id, limit))
+            return [dict(row) for row in c.fetchall()]
+        except Error as e:
+            print(f"Error getting points history: {e}")
+            return []
+        finally:
+            conn.close()
+    return []
+
+# Balance per user/league from the newest snapshot plus the ledger after it. Params: snapshot id, ledger id
+LEDGER_BALANCES_QUERY = """
+    SELECT user_id, league_id, SUM(delta) AS balance FROM (
+        SELECT user_id, league_id, balance AS delta FROM ledger_snapshot_balances WHERE snapshot_id = ?
+        UNION ALL
+        SELECT user_id, league_id, delta FROM points_ledger WHERE id > ?
+    )
+    GROUP BY user_id, league_id
+"""
+
+def latest_ledger_snapshot(c):
+    """(snapshot id, ledger id it covers up to), (0, 0) before the first one"""
+    c.execute("SELECT id, ledger_id FROM ledger_snapshots ORDER BY id DESC LIMIT 1")
+    row = c.fetchone()
+    return (row[0], row[1]) if row else (0, 0)
+
+def ledger_balance(user_id, league_id):
+    """Rebuild one balance from the ledger: newest snapshot plus the entries since, both off an index"""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            snapshot_id, ledger_id = latest_ledger_snapshot(c)
+            c.execute("""
+                SELECT COALESCE((SELECT balance FROM ledger_snapshot_balances
+                                 WHERE snapshot_id = ? AND user_id = ? AND league_id = ?), 0)
+                     + COALESCE((SELECT SUM(delta) FROM points_ledger
+                                 WHERE user_id = ? AND league_id = ? AND id > ?), 0)
+            """, (snapshot_id, user_id, league_id, user_id, league_id, ledger_id))
+            return c.fetchone()[0]
+        except Error as e:
+            print(f"Error rebuilding ledger balance: {e}")
+            return None
+        finally:
+            conn.close()
+    return None
+
+def snapshot_points_ledger():
+    """Store every balance as of the newest ledger entry, built from the last snapshot plus what came after.
+    Old snapshots past LEDGER_SNAPSHOTS_KEPT are dropped. Returns how many balances were stored."""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            # Takes the write lock first so no ledger rows land between reading the high water mark and using it
+            c.execute("INSERT INTO ledger_snapshots (ledger_id) VALUES (0)")
+            snapshot_id = c.lastrowid
+            c.execute("SELECT COALESCE(MAX(id), 0) FROM points_ledger")
+            ledger_id = c.fetchone()[0]
+            c.execute("UPDATE ledger_snapshots SET ledger_id = ? WHERE id = ?", (ledger_id, snapshot_id))
+            c.execute("SELECT id, ledger_id FROM ledger_snapshots WHERE id < ? ORDER BY id DESC LIMIT 1", (snapshot_id,))
+            previous = c.fetchone() or (0, 0)
+            c.execute("""
+                INSERT INTO ledger_snapshot_balances (snapshot_id, user_id, league_id, balance)
+                SELECT ?, user_id, league_id, SUM(delta) FROM (
+                    SELECT user_id, league_id, balance AS delta FROM ledger_snapshot_balances WHERE snapshot_id = ?
+                    UNION ALL
+                    SELECT user_id, league_id, delta FROM points_ledger WHERE id > ? AND id <= ?
+                )
+                GROUP BY user_id, league_id
+            """, (snapshot_id, previous[0], previous[1], ledger_id))
+            stored = c.rowcount
+            c.execute("SELECT id FROM ledger_snapshots ORDER BY id DESC LIMIT 1 OFFSET ?", (LEDGER_SNAPSHOTS_KEPT - 1,))
+            oldest_kept = c.fetchone()
+            if oldest_kept:
+                c.execute("DELETE FROM ledger_snapshot_balances WHERE snapshot_id < ?", (oldest_kept[0],))
+                c.execute("DELETE FROM ledger_snapshots WHERE id < ?", (oldest_kept[0],))
+            conn.commit()
+            return stored
+        except Error as e:
+            conn.rollback()
+            print(f"Error snapshotting points ledger: {e}")
+            return 0
+        finally:
+            conn.close()
+    return 0
+
+def check_points_ledger():
+    """Every user/league whose league_scores balance doesn't match the ledger, as
+    [{user_id, league_id, score, ledger_balance}]. Empty means the two agree."""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            snapshot_id, ledger_id = latest_ledger_snapshot(c)
+            c.execute(f"""
+                WITH ledger AS ({LEDGER_BALANCES_QUERY})
+                SELECT s.user_id, s.league_id, COALESCE(s.score, 0), COALESCE(ledger.balance, 0)
+                FROM league_scores s
+                LEFT JOIN ledger ON ledger.user_id = s.user_id AND ledger.league_id = s.league_id
+                WHERE COALESCE(s.score, 0) != COALESCE(ledger.balance, 0)
+            """, (snapshot_id, ledger_id))
+            return [
+                {"user_id": row[0], "league_id": row[1], "score": row[2], "ledger_balance": row[3]}
+                for row in c.fetchall()
+            ]
+        except Error as e:
+            print(f"Error checking points ledger: {e}")
+            return None
+        finally:
+            conn.close()
+    return None
+
+'''BET LEDGER'''
+# Every bet goes through here. The balance check and the debit are one conditional UPDATE, so two bets
+# racing each other can't both pass a check on a stale score and overdraw, and the debits plus every
+# bet row go in one transaction. Anything slow (odds, multipliers) is worked out by the caller first so
+# the write lock is only held for a handful of statements.
+GLOBAL_LEAGUE_ID = 1
+
+# Player picks, one per user/match/player/league (uq_user_player_predictions_pick)
+PLAYER_PICK_UPSERT = '''
+    INSERT INTO user_player_predictions
+    (user_id, match_id, player_id, goals_prediction, shots_prediction,
+     minutes_prediction, multiplier, potential_points, league_id, bet_amount)
+    VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)
+    ON CONFLICT (user_id, match_id, player_id, league_id) DO UPDATE SET
+        goals_prediction = excluded.goals_prediction, shots_prediction = excluded.shots_prediction,
+        minutes_prediction = 0, multiplier = excluded.multiplier, potential_points = excluded.potential_points,
+        bet_amount = excluded.bet_amount, created_at = CURRENT_TIMESTAMP
+'''
+
+def bet_leagues(league_id):
+    """Leagues a bet lands in, the one it was placed in first. Bets always count in the global league too"""
+    league_id = int(league_id)
+    if league_id == GLOBAL_LEAGUE_ID:
+        return [league_id]
+    return [league_id, GLOBAL_LEAGUE_ID]
+
+def debit_league_score(c, user_id, league_id, amount):
+    """Take amount off the user's score in a league if they can cover it. False (nothing taken) if not"""
+    c.execute("UPDATE league_scores SET score = score - ? WHERE user_id = ? AND league_id = ? AND score >= ?",
+              (amount, user_id, league_id, amount))
+    return c.rowcount == 1
+
+def debit_bet(c, user_id, leagues, amount):
+    """Debit a bet from each of its leagues, returning the ones charged ([] if the bet is refused). The league
+    it was placed in has to cover it. The global copy is left out when the global score can't, so there is
+    never a bet row for a stake that wasn't taken"""
+    if not debit_league_score(c, user_id, leagues[0], amount):
+        return []
+    return [leagues[0]] + [league_id for league_id in leagues[1:] if debit_league_score(c, user_id, league_id, amount)]
+
+def place_bet(user_id, league_id, match_id, bet_amount, outcome_prediction=None, home_score=0, away_score=0,
+              multiplier=1.0, potential_exact_points=100, potential_result_points=100):
+    """Place a score bet (outcome_prediction None) or an outcome bet in a league and, if it covers it, the global league."""
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            set_ledger_reason(c, "bet", match_id)
+            leagues = debit_bet(c, user_id, bet_leagues(league_id), bet_amount)
+            if not leagues:
+                conn.rollback()
+                return {"success": False, "message": f"Insufficient points to place a bet of {bet_amount}"}
+
             if outcome_prediction is not None:
                 # Outcome bet: ignore exact score predictions.
-                home_score = 0
-                away_score = 0
+                c.executemany(OUTCOME_BET_INSERT, [
+                    (user_id, match_id, 0, 0, bet_amount, outcome_prediction, multiplier, potential_exact_points, potential_result_points, league)
+                    for league in leagues
+                ])
             else:
-                # Exact score prediction bet: outcome_prediction remains NULL.
-                outcome_prediction = None  # Explicitly set for clarity
-            
-            # Insert the bet into the unified table
-            c.execute('''
-                INSERT INTO user_predictions
-                (user_id, match_id, home_score, away_score, bet_amount, outcome_prediction)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (user_id, match_id, home_score, away_score, bet_amount, outcome_prediction))
-            
+                c.executemany(SCORE_BET_UPSERT, [
+                    (user_id, match_id, home_score, away_score, bet_amount, multiplier, potential_exact_points, potential_result_points, league)
+                    for league in leagues
+                ])
+
+            clear_ledger_reason(c)
             conn.commit()
             return {"success": True, "message": "Bet placed successfully"}
         except Exception as e:
+            conn.rollback()
             print(f"Error placing bet: {e}")
             return {"success": False, "message": "Error placing bet"}
         finally:
             conn.close()
     return {"success": False, "message": "Database connection failed"}
 
+def place_player_bets(user_id, match_id, picks):
+    """Place a slip of player picks, dicts with player_id, goals, shots, league_id, bet_amount, multiplier and
+    potential_points. Returns one result per pick in the same order, or None if nothing could be saved.
+
+    The slip is checked first, then each league it's placed in is debited its total in one statement and every
+    pick (plus its global league copy, if the global score covered it) is written with one executemany. A
+    league that can't cover its total has all of its picks refused, nothing is half placed."""
+    results = [None] * len(picks)
+    by_league = {}
+    for i, pick in enumerate(picks):
+        league_id = int(pick["league_id"])
+        group = by_league.setdefault(league_id, {})
+        if pick["player_id"] in group:
+            results[i] = {"player_id": pick["player_id"], "success": False, "message": "Player already picked on this slip"}
+            continue
+        group[pick["player_id"]] = i
+
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            set_ledger_reason(c, "player bet", match_id)
+            rows = []
+            for league_id, group in by_league.items():
+                total = sum(picks[i]["bet_amount"] for i in group.values())
+                leagues = debit_bet(c, user_id, bet_leagues(league_id), total)
+                if not leagues:
+                    for i in group.values():
+                        results[i] = {
+                            "player_id": picks[i]["player_id"],
+                            "success": False,
+                            "message": f"Insufficient points to place a bet of {picks[i]['bet_amount']}"
+                        }
+                    continue
+                for i in group.values():
+                    pick = picks[i]
+                    rows.extend(
+                        (user_id, match_id, pick["player_id"], pick["goals"], pick["shots"],
+                         pick["multiplier"], pick["potential_points"], league, pick["bet_amount"])
+                        for league in leagues
+                    )
+                    results[i] = {
+                        "player_id": pick["player_id"],
+                        "success": True,
+                        "multiplier": pick["multiplier"],
+                        "potential_points": pick["potential_points"]
+                    }
+            c.executemany(PLAYER_PICK_UPSERT, rows)
+            clear_ledger_reason(c)
+            conn.commit()
+            return results
+        except Exception as e:
+            conn.rollback()
+            print(f"Error placing player bets: {e}")
+            return None
+        finally:
+            conn.close()
+    return None
+
 def process_match_bets(match_id, home_goals, away_goals):
     """Process all bets for a given match and update user scores accordingly."""
     conn = get_db_connection()
@@ -837,6 +1039,7 @@ def process_match_bets(match_id, home_goals, away_goals):
                 if outcome_prediction is not None:
                     if outcome_prediction == actual_result:
                         winnings = bet_amount * 3
+                        set_ledger_reason(c, "settlement", bet_id)
                         c.execute(
                             "UPDATE league_scores SET score = score + ? WHERE user_id = ? AND league_id = ?",
                             (winnings, user_id, league_id)
@@ -846,6 +1049,7 @@ def process_match_bets(match_id, home_goals, away_goals):
                     #Exact Score predictions
                     if home_score == home_goals and away_score == away_goals:
                         winnings = bet_amount * 5
+                        set_ledger_reason(c, "settlement", bet_id)
                         c.execute(
                             "UPDATE league_scores SET score = score + ? WHERE user_id = ? AND league_id = ?",
                             (winnings, user_id, league_id)
@@ -853,11 +1057,13 @@ def process_match_bets(match_id, home_goals, away_goals):
                     elif (home_score > away_score and home_goals > away_goals) or (away_score > home_score and away_goals > home_goals) or (home_score == away_score and home_goals == away_goals):
                         # Award a lower payout for a correct outcome only
                         winnings = bet_amount * 2
+                        set_ledger_reason(c, "settlement", bet_id)
                         c.execute(
                             "UPDATE league_scores SET score = score + ? WHERE user_id = ? AND league_id = ?",
                             (winnings, user_id, league_id)
                         )
             
+            clear_ledger_reason(c)
             conn.commit()
             return True
         except Exception as e:
@@ -900,37 +1106,6 @@ def get_profile_pic(user):
             conn.close()
     return profile_pic
 
-def ensure_global_league_exists():
-    """
-    Make sure the global league exists in the database.
-    """
-    conn = get_db_connection()
-    if conn is not None:
-        try:
-            c = conn.cursor()
-            
-            # Check if global league exists (ID = 1)
-            c.execute("SELECT id FROM fantasyLeagues WHERE id = 1")
-            global_league = c.fetchone()
-            
-            if not global_league:
-                # Create global league if it doesn't exist
-                c.execute('''
-                    INSERT INTO fantasyLeagues 
-                    (id, league_name, league_type, privacy, members) 
-                    VALUES (1, 'Global Ranking', 'classic', 'Public', '')
-                ''')
-                conn.commit()
-                print("Created Global Ranking league")
-            
-            return True
-        except Error as e:
-            print(f"Error ensuring global league exists: {e}")
-            return False
-        finally:
-            conn.close()
-    return False
-
 def ensure_user_in_global_league(user_id, username):
     """
     Make sure the user is part of the global league.
@@ -940,36 +1115,12 @@ def ensure_user_in_global_league(user_id, username):
     if conn is not None:
         try:
             c = conn.cursor()
-            
-            # Check if user is in global league scores
-            c.execute("SELECT id FROM league_scores WHERE user_id = ? AND league_id = 1", (user_id,))
-            user_score = c.fetchone()
-            
-            if not user_score:
-                # Add user to global league scores with starting score
-                c.execute("INSERT INTO league_scores (user_id, league_id, score) VALUES (?, 1, 1000)", (user_id,))
-                
-                # Update global league members
-                c.execute("SELECT members FROM fantasyLeagues WHERE id = 1")
-                members_row = c.fetchone()
-                members = members_row[0].split(",") if members_row and members_row[0] else []
-                
-                if username not in members:
-                    members.append(username)
-                    updated_members = ",".join(members)
-                    c.execute("UPDATE fantasyLeagues SET members = ? WHERE id = 1", (updated_members,))
-                
-                # Add global league to user's leagues
-                c.execute("SELECT leagues FROM users WHERE id = ?", (user_id,))
-                leagues_row = c.fetchone()
-                user_leagues = leagues_row[0] if leagues_row and leagues_row[0] else ""
-                
-                if "1" not in user_leagues.split(","):
-                    updated_leagues = f"{user_leagues},1".strip(",")
-                    c.execute("UPDATE users SET leagues = ? WHERE id = ?", (updated_leagues, user_id))
-                
-                conn.commit()
-            
+            # Both are no-ops if they're already in
+            c.execute("INSERT OR IGNORE INTO league_members (league_id, user_id) VALUES (1, ?)", (user_id,))
+            set_ledger_reason(c, "join", 1)
+            c.execute("INSERT OR IGNORE INTO league_scores (user_id, league_id, score) VALUES (?, 1, 1000)", (user_id,))
+            clear_ledger_reason(c)
+            conn.commit()
             return True
         except Error as e:
             print(f"Error adding user to global league: {e}")
@@ -989,6 +1140,8 @@ def end_week_for_league(league_id):
     if conn:
         try:
             c = conn.cursor()
+            begin_leaderboard_bulk(c, league_id)
+            set_ledger_reason(c, "week reset", league_id)
             # 1. Find the user_id with the highest score
             c.execute("""
                 SELECT user_id, score
@@ -1014,7 +1167,9 @@ def end_week_for_league(league_id):
                 SET score = 1000
                 WHERE league_id = ?
             """, (league_id,))
+            finish_leaderboard_bulk(c, league_id)
             
+            clear_ledger_reason(c)
             conn.commit()
             return True
         except Error as e:
@@ -1024,49 +1179,47 @@ def end_week_for_league(league_id):
             conn.close()
     return False
 
-def get_recent_league_bets(league_id, limit=5):
-    """Get the most recent unique fixture bets made by users in a league for league.html"""
+# Newest bet time per match comes straight off the (league_id, match_id, created_at) index and the cursor
+# and LIMIT apply to that, so only the bets actually shown get read from the table (with their username)
+RECENT_LEAGUE_BETS_QUERY = '''
+    SELECT p.match_id, u.username, p.created_at, p.home_score, p.away_score
+    FROM user_predictions p
+    JOIN users u ON u.id = p.user_id
+    WHERE p.id IN (
+        SELECT (
+            SELECT id FROM user_predictions newest
+            WHERE newest.league_id = bets.league_id AND newest.match_id = bets.match_id
+            ORDER BY newest.created_at DESC, newest.id DESC LIMIT 1
+        )
+        FROM user_predictions bets
+        WHERE bets.league_id = ?
+        GROUP BY bets.match_id
+        HAVING ? IS NULL OR (MAX(bets.created_at), bets.match_id) < (?, ?)
+        ORDER BY MAX(bets.created_at) DESC, bets.match_id DESC
+        LIMIT ?
+    )
+    ORDER BY p.created_at DESC, p.match_id DESC
+'''
+
+def get_recent_league_bets(league_id, limit=5, before=None):
+    """The latest bet on each match in a league, newest first, for league.html. before is the
+    (created_at, match_id) of the last bet already shown, to get the next page."""
     conn = get_db_connection()
     if conn is not None:
         try:
             c = conn.cursor()
-            
-            # Fget all unique match_ids with their latest bet time
-            c.execute('''
-                SELECT match_id, MAX(created_at) as latest_bet_time
-                FROM user_predictions
-                WHERE league_id = ?
-                GROUP BY match_id
-                ORDER BY latest_bet_time DESC
-                LIMIT ?
-            ''', (league_id, limit))
-            
-            matches = c.fetchall()
-            
-            # For each match, get the user who made the latest bet
-            recent_bets = []
-            for match in matches:
-                match_id = match[0]
-                c.execute('''
-                    SELECT u.username, p.created_at, p.home_score, p.away_score
-                    FROM user_predictions p
-                    JOIN users u ON p.user_id = u.id
-                    WHERE p.match_id = ? AND p.league_id = ?
-                    ORDER BY p.created_at DESC
-                    LIMIT 1
-                ''', (match_id, league_id))
-                
-                bet_info = c.fetchone()
-                if bet_info:
-                    recent_bets.append({
-                        'match_id': match_id,
-                        'username': bet_info[0],
-                        'created_at': bet_info[1],
-                        'home_score': bet_info[2],
-                        'away_score': bet_info[3]
-                    })
-            
-            return recent_bets
+            before_time, before_match = before if before else (None, None)
+            c.execute(RECENT_LEAGUE_BETS_QUERY, (league_id, before_time, before_time, before_match, limit))
+            return [
+                {
+                    'match_id': row[0],
+                    'username': row[1],
+                    'created_at': row[2],
+                    'home_score': row[3],
+                    'away_score': row[4]
+                }
+                for row in c.fetchall()
+            ]
         except Error as e:
             print(f"Error getting recent league bets: {e}")
             return []
@@ -1075,6 +1228,76 @@ def get_recent_league_bets(league_id, limit=5):
     return []
 
 
+'''PREDICTION ARCHIVE'''
+# Settled bets older than the horizon move to the *_archive tables (migration 8), in batches so the
+# write lock is only held briefly each time. History pages read the all_* views instead.
+ARCHIVE_AFTER_DAYS = 30
+ARCHIVE_BATCH_SIZE = 2000
+
+# Columns shared by the live prediction tables and their archives (and the all_* views), in table order
+PREDICTION_COLUMNS = (
+    "id, user_id, match_id, home_score, away_score, multiplier, potential_exact_points, potential_result_points, "
+    "created_at, points_earned, exact_score, correct_result, league_id, bet_amount, outcome_prediction"
+)
+PLAYER_PREDICTION_COLUMNS = (
+    "id, user_id, match_id, player_id, goals_prediction, shots_prediction, minutes_prediction, multiplier, "
+    "potential_points, points_earned, prediction_correct, created_at, league_id, bet_amount"
+)
+
+ARCHIVED_TABLES = [
+    ("user_predictions", "user_predictions_archive", PREDICTION_COLUMNS),
+    ("user_player_predictions", "user_player_predictions_archive", PLAYER_PREDICTION_COLUMNS),
+]
+
+def archive_settled_predictions(days=ARCHIVE_AFTER_DAYS, batch_size=ARCHIVE_BATCH_SIZE):
+    """Move settled predictions made more than days ago into the archive tables.
+    Returns {table: rows moved}, or None if it failed (batches already done stay moved)."""
+    moved = {}
+    conn = get_db_connection()
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            # created_at is CURRENT_TIMESTAMP (UTC), so the cutoff has to come from SQLite too, not local time
+            c.execute("SELECT datetime('now', ?)", (f"-{int(days)} days",))
+            cutoff = c.fetchone()[0]
+            for table, archive, columns in ARCHIVED_TABLES:
+                moved[table] = 0
+                after_id = 0
+                while True:
+                    # Next batch by id, the copy and the delete then only touch that id range
+                    c.execute(f"""
+                        SELECT id FROM {table}
+                        WHERE id > ? AND points_earned IS NOT NULL AND created_at < ?
+                        ORDER BY id LIMIT ?
+                    """, (after_id, cutoff, batch_size))
+                    ids = [row[0] for row in c.fetchall()]
+                    if not ids:
+                        break
+                    batch = (ids[0], ids[-1], cutoff)
+                    c.execute(f"""
+                        INSERT OR REPLACE INTO {archive} ({columns})
+                        SELECT {columns} FROM {table}
+                        WHERE id BETWEEN ? AND ? AND points_earned IS NOT NULL AND created_at < ?
+                    """, batch)
+                    c.execute(f"""
+                        DELETE FROM {table}
+                        WHERE id BETWEEN ? AND ? AND points_earned IS NOT NULL AND created_at < ?
+                    """, batch)
+                    moved[table] += c.rowcount
+                    conn.commit()
+                    after_id = ids[-1]
+            return moved
+        except Error as e:
+            conn.rollback()
+            print(f"Error archiving predictions: {e}")
+            return None
+        finally:
+            conn.close()
+    return None
+
+
+SETTLEMENT_FETCH_TIMEOUT = 20  # Seconds to wait for one league's results when settling
+
 async def process_all_bets():
     """
     Process all pending bets for completed matches.
@@ -1106,55 +1329,48 @@ async def process_all_bets():
             return {"success": True, "message": "No pending bets to process", "matches_processed": 0, "predictions_processed": 0}
         
         # Process matches asynchronously
-        async with aiohttp.ClientSession() as session:
-            from understat import Understat
-            understat = Understat(session)
+        understat = get_understat_client()
             
-            # Get all completed matches from various leagues
-            all_results = {}
-            for league in ["epl", "La_liga", "Bundesliga", "Serie_A", "Ligue_1"]:
-                try:
-                    results = await understat.get_league_results(league, 2024)
-                    for match in results:
-                        all_results[match["id"]] = match
-                except Exception as e:
-                    print(f"Error fetching results for {league}: {e}")
+        # Results for just the pending matches. Only the leagues/seasons they're in get refreshed (at once,
+        # with a timeout each), a league that fails is skipped and its bets wait for the next run
+        all_results, failed_leagues = await understat.find_results(all_match_ids, timeout=SETTLEMENT_FETCH_TIMEOUT)
             
-            matches_processed = 0
-            match_predictions_processed = 0
-            player_predictions_processed = 0
+        matches_processed = 0
+        match_predictions_processed = 0
+        player_predictions_processed = 0
             
-            for match_id in all_match_ids:
-                # Check if the match exists in results and is completed
-                if match_id not in all_results:
-                    continue
+        for match_id in all_match_ids:
+            # Check if the match exists in results and is completed
+            if match_id not in all_results:
+                continue
                 
-                match = all_results[match_id]
-                match_datetime = datetime.strptime(match["datetime"], "%Y-%m-%d %H:%M:%S")
-                current_time = datetime.now()
+            match = all_results[match_id]
+            match_datetime = datetime.strptime(match["datetime"], "%Y-%m-%d %H:%M:%S")
+            current_time = datetime.now()
                 
-                # Only process matches that ended at least 2 hours ago
-                if match_datetime + timedelta(hours=2) > current_time:
-                    continue
+            # Only process matches that ended at least 2 hours ago
+            if match_datetime + timedelta(hours=2) > current_time:
+                continue
                 
-                # Process regular match predictions
-                if match_id in match_ids:
-                    processed = await process_match_predictions(conn, match_id, match)
-                    match_predictions_processed += processed
+            # Process regular match predictions
+            if match_id in match_ids:
+                processed = await process_match_predictions(conn, match_id, match)
+                match_predictions_processed += processed
                 
-                # Process player predictions
-                if match_id in player_match_ids:
-                    processed = await process_player_predictions(conn, match_id, match, understat)
-                    player_predictions_processed += processed
+            # Process player predictions
+            if match_id in player_match_ids:
+                processed = await process_player_predictions(conn, match_id, match, understat)
+                player_predictions_processed += processed
                 
-                matches_processed += 1
+            matches_processed += 1
         
         return {
             "success": True,
             "message": f"Processed {matches_processed} matches with {match_predictions_processed} match predictions and {player_predictions_processed} player predictions",
             "matches_processed": matches_processed,
             "match_predictions_processed": match_predictions_processed,
-            "player_predictions_processed": player_predictions_processed
+            "player_predictions_processed": player_predictions_processed,
+            "failed_leagues": [f"{league} {season}" for league, season in failed_leagues]
         }
     
     except Exception as e:
@@ -1210,6 +1426,7 @@ async def process_match_predictions(conn, match_id, match):
                     """, (points_earned, pred_id))
                     
                     # Update league scores
+                    set_ledger_reason(c, "settlement", pred_id)
                     c.execute("""
                         UPDATE league_scores
                         SET score = score + ?
@@ -1252,6 +1469,7 @@ async def process_match_predictions(conn, match_id, match):
                 
                 # Update league scores if points were earned
                 if points_earned > 0:
+                    set_ledger_reason(c, "settlement", pred_id)
                     c.execute("""
                         UPDATE league_scores
                         SET score = score + ?
@@ -1260,6 +1478,7 @@ async def process_match_predictions(conn, match_id, match):
             
             predictions_processed += 1
         
+        clear_ledger_reason(c)
         conn.commit()
         return predictions_processed
         
@@ -1360,6 +1579,7 @@ async def process_player_predictions(conn, match_id, match, understat):
             
             # Update league scores if points were earned
             if points_earned > 0:
+                set_ledger_reason(c, "player settlement", pred_id)
                 c.execute("""
                     UPDATE league_scores
                     SET score = score + ?
@@ -1368,6 +1588,7 @@ async def process_player_predictions(conn, match_id, match, understat):
             
             predictions_processed += 1
         
+        clear_ledger_reason(c)
         conn.commit()
         return predictions_processed
         
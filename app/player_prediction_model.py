@@ -1,76 +1,77 @@
-import aiohttp
-from understat import Understat
+import asyncio
+from .match_context import MatchContext
 
 class PlayerPredictionSystem:
     def __init__(self):
         self.base_points = 100  # Works similar to PredictionSystem
     
     # No way to get definite players that will play so predict
-    async def get_likely_match_players(self, match_id, league_code, season):
-        """Get likely players for an upcoming match based on recent games"""
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
+    async def get_likely_match_players(self, match_id, league_code, season, context=None):
+        """Get likely players for an upcoming match based on recent games. Pass the request's MatchContext to share its fetches."""
+        if context is None:
+            context = MatchContext(match_id, league_code, season)
+        understat = context
             
-            # Get match details
-            fixtures = await understat.get_league_fixtures(league_code, season)
-            match = next((fixture for fixture in fixtures if fixture["id"] == match_id), None)
+        # Get match details
+        entry = await context.get_match()
             
-            if not match:
-                return None
+        # Only upcoming fixtures can be predicted
+        if not entry or entry["is_result"]:
+            return None
+        match = entry["match"]
+        league_code = entry["league"]
+        season = entry["season"]
                 
-            home_team = match["h"]["title"]
-            away_team = match["a"]["title"]
+        home_team = match["h"]["title"]
+        away_team = match["a"]["title"]
             
-            # Get team players
-            home_players = await understat.get_team_players(home_team, season)
-            away_players = await understat.get_team_players(away_team, season)
-            
-            # Get recent matches to identify active players
-            home_results = await understat.get_team_results(home_team, season)
-            away_results = await understat.get_team_results(away_team, season)
-            
-            # Sort by recent match date
-            home_recent_matches = sorted(home_results, key=lambda x: x["datetime"], reverse=True)[:3]
-            away_recent_matches = sorted(away_results, key=lambda x: x["datetime"], reverse=True)[:3]
-            
-            # Get player data from recent matches
-            home_recent_players = []
-            away_recent_players = []
+        # Team players and recent results all at once
+        home_players, away_players, home_results, away_results = await asyncio.gather(
+            understat.get_team_players(home_team, season),
+            understat.get_team_players(away_team, season),
+            understat.get_team_results(home_team, season),
+            understat.get_team_results(away_team, season)
+        )
             
-            # Await heavy
-            for match in home_recent_matches:
-                try:
-                    match_players = await understat.get_match_players(match["id"])
-                    # Filter to just this team's players
-                    if "h" in match_players and match["h"]["title"] == home_team:
-                        home_recent_players.extend(match_players["h"].values())
-                    elif "a" in match_players and match["a"]["title"] == home_team:
-                        home_recent_players.extend(match_players["a"].values())
-                except Exception as e:
-                    print(f"Error getting players for match {match['id']}: {e}")
+        # Sort by recent match date
+        home_recent_matches = sorted(home_results, key=lambda x: x["datetime"], reverse=True)[:3]
+        away_recent_matches = sorted(away_results, key=lambda x: x["datetime"], reverse=True)[:3]
             
-            for match in away_recent_matches:
-                try:
-                    match_players = await understat.get_match_players(match["id"])
-                    # Filter to just this team's players
-                    if "h" in match_players and match["h"]["title"] == away_team:
-                        away_recent_players.extend(match_players["h"].values())
-                    elif "a" in match_players and match["a"]["title"] == away_team:
-                        away_recent_players.extend(match_players["a"].values())
-                except Exception as e:
-                    print(f"Error getting players for match {match['id']}: {e}")
+        # Get player data from recent matches, all six together. return_exceptions so one bad
+        # match doesn't throw away the others
+        recent_matches = home_recent_matches + away_recent_matches
+        recent_match_players = await asyncio.gather(
+            *(understat.get_match_players(recent_match["id"]) for recent_match in recent_matches),
+            return_exceptions=True
+        )
+        home_recent_players = self.team_players_in_matches(home_team, home_recent_matches, recent_match_players[:len(home_recent_matches)])
+        away_recent_players = self.team_players_in_matches(away_team, away_recent_matches, recent_match_players[len(home_recent_matches):])
             
-            # Process and rank players
-            processed_home_players = self.process_and_rank_players(home_players, home_recent_players)
-            processed_away_players = self.process_and_rank_players(away_players, away_recent_players)
+        # Process and rank players
+        processed_home_players = self.process_and_rank_players(home_players, home_recent_players)
+        processed_away_players = self.process_and_rank_players(away_players, away_recent_players)
             
-            return {
-                "match": match,
-                "home_team": home_team,
-                "away_team": away_team,
-                "home_players": processed_home_players,
-                "away_players": processed_away_players
-            }
+        return {
+            "match": match,
+            "home_team": home_team,
+            "away_team": away_team,
+            "home_players": processed_home_players,
+            "away_players": processed_away_players
+        }
+    
+    def team_players_in_matches(self, team, recent_matches, match_players_list):
+        """Pull one team's players out of each recent match's player data"""
+        recent_players = []
+        for recent_match, match_players in zip(recent_matches, match_players_list):
+            if isinstance(match_players, Exception):
+                print(f"Error getting players for match {recent_match['id']}: {match_players}")
+                continue
+            # Filter to just this team's players
+            if "h" in match_players and recent_match["h"]["title"] == team:
+                recent_players.extend(match_players["h"].values())
+            elif "a" in match_players and recent_match["a"]["title"] == team:
+                recent_players.extend(match_players["a"].values())
+        return recent_players
     
     def process_and_rank_players(self, team_players, recent_players):
         """Process and rank players by likelihood of playing"""
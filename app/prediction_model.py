@@ -1,12 +1,17 @@
-import aiohttp
-from understat import Understat
+import asyncio
+import hashlib
+import json
 import math
+import numpy as np
+from .understat_client import get_understat_client
+from .match_context import MatchContext
 
 '''PREDICTION MODEL'''
 # Gonna try basic class of functions
 class PredictionSystem:
     def __init__(self):
         self.home_weight = 1.05  # Home advantage multiplier.. Change it? Maybe for teams that perform esp well at home?
+        self.max_goals = 6  # Scorelines counted up to 6-6 for probabilities
         #self.base_points = 100  # Base points for correct predictions... More for risky... To be used in the leagues
         
     # Creating a summed xg here of last 5 games which will be used to predict score
@@ -28,84 +33,82 @@ class PredictionSystem:
         adjusted_xg = weighted_xg * xg_performance
         return round(adjusted_xg, 2)
 
-    async def get_team_recent_data(self, team_name, league_code, season):
+    async def get_team_recent_data(self, team_name, league_code, season, context=None):
         """Get recent match data for a team with opposition information"""
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
-            results = await understat.get_team_results(team_name, season) # gets whole season
+        understat = context or get_understat_client()
+        results = await understat.get_team_results(team_name, season) # gets whole season
             
             
-            total_goals = 0
-            total_xg = 0
+        total_goals = 0
+        total_xg = 0
             
-            for match in results:
-                if match["h"]["title"] == team_name:
-                    if match["goals"]["h"] is not None and match["xG"]["h"] is not None:
-                        total_goals += int(match["goals"]["h"])
-                        total_xg += float(match["xG"]["h"])
-                else:
-                    if match["goals"]["a"] is not None and match["xG"]["a"] is not None:
-                        total_goals += int(match["goals"]["a"])
-                        total_xg += float(match["xG"]["a"])
+        for match in results:
+            if match["h"]["title"] == team_name:
+                if match["goals"]["h"] is not None and match["xG"]["h"] is not None:
+                    total_goals += int(match["goals"]["h"])
+                    total_xg += float(match["xG"]["h"])
+            else:
+                if match["goals"]["a"] is not None and match["xG"]["a"] is not None:
+                    total_goals += int(match["goals"]["a"])
+                    total_xg += float(match["xG"]["a"])
             
-            # ratio
-            xg_performance = 1.0
-            if total_xg >= 1.0:
-                xg_performance = total_goals / total_xg
-                # Cap between 0.7 and 1.3
-                xg_performance = max(0.7, min(1.3, xg_performance))
+        # ratio
+        xg_performance = 1.0
+        if total_xg >= 1.0:
+            xg_performance = total_goals / total_xg
+            # Cap between 0.7 and 1.3
+            xg_performance = max(0.7, min(1.3, xg_performance))
             
-            # Sort by most recent
-            recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
+        # Sort by most recent
+        recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
             
-            # Extract xG values and opposition teams based on home/away
-            # Playing against a top team will affect the xg... Don't want that to affect the model TOO much
-            recent_xg = []
-            recent_goals = []
-            opposition_teams = []
-            match_dates = []
-            match_results = []  # W, D, L
+        # Extract xG values and opposition teams based on home/away
+        # Playing against a top team will affect the xg... Don't want that to affect the model TOO much
+        recent_xg = []
+        recent_goals = []
+        opposition_teams = []
+        match_dates = []
+        match_results = []  # W, D, L
             
-            for match in recent_results:
-                if match["h"]["title"] == team_name:
-                    # Team played at home
-                    recent_xg.append(float(match["xG"]["h"]))
-                    recent_goals.append(int(match["goals"]["h"]))
-                    opposition_teams.append(match["a"]["title"])
-                    result = "W" if match["goals"]["h"] > match["goals"]["a"] else "D" if match["goals"]["h"] == match["goals"]["a"] else "L"
-                    match_results.append(result)
-                else:
-                    # Team played away
-                    recent_xg.append(float(match["xG"]["a"]))
-                    recent_goals.append(int(match["goals"]["a"]))
-                    opposition_teams.append(match["h"]["title"])
-                    result = "W" if match["goals"]["a"] > match["goals"]["h"] else "D" if match["goals"]["a"] == match["goals"]["h"] else "L"
-                    match_results.append(result)
+        for match in recent_results:
+            if match["h"]["title"] == team_name:
+                # Team played at home
+                recent_xg.append(float(match["xG"]["h"]))
+                recent_goals.append(int(match["goals"]["h"]))
+                opposition_teams.append(match["a"]["title"])
+                result = "W" if match["goals"]["h"] > match["goals"]["a"] else "D" if match["goals"]["h"] == match["goals"]["a"] else "L"
+                match_results.append(result)
+            else:
+                # Team played away
+                recent_xg.append(float(match["xG"]["a"]))
+                recent_goals.append(int(match["goals"]["a"]))
+                opposition_teams.append(match["h"]["title"])
+                result = "W" if match["goals"]["a"] > match["goals"]["h"] else "D" if match["goals"]["a"] == match["goals"]["h"] else "L"
+                match_results.append(result)
                 
                 
-                match_date = match["datetime"].split(" ")[0]
-                match_dates.append(match_date)
+            match_date = match["datetime"].split(" ")[0]
+            match_dates.append(match_date)
                 
-            return {
-                "xg": recent_xg, 
-                "goals": recent_goals,
-                "opponents": opposition_teams,
-                "dates": match_dates,
-                "results": match_results,
-                "xg_performance": round(xg_performance, 2)  # Include the performance ratio
-            }
+        return {
+            "xg": recent_xg, 
+            "goals": recent_goals,
+            "opponents": opposition_teams,
+            "dates": match_dates,
+            "results": match_results,
+            "xg_performance": round(xg_performance, 2)  # Include the performance ratio
+        }
     
-    async def get_league_positions(self, league_code, season):
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
-            table = await understat.get_league_table(league_code, season, with_headers=False)
+    async def get_league_positions(self, league_code, season, context=None):
+        understat = context or get_understat_client()
+        table = await understat.get_league_table(league_code, season, with_headers=False)
             
-            positions = {}
-            for position, team_data in enumerate(table):
-                team_name = team_data[0]
-                positions[team_name] = position + 1
+        positions = {}
+        for position, team_data in enumerate(table):
+            team_name = team_data[0]
+            positions[team_name] = position + 1
                 
-            return positions
+        return positions
         
     def adjust_for_opposition(self, expected_score, opposition_positions, league_size=20):
         if not opposition_positions:
@@ -122,95 +125,139 @@ class PredictionSystem:
     """
     async def get_team_xg_performance(self, team_name, season):
         # Function to see whether they outperform or underperform their xg
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
-            results = await understat.get_team_results(team_name, season)
+        understat = get_understat_client()
+        results = await understat.get_team_results(team_name, season)
             
-            total_goals = 0
-            total_xg = 0
+        total_goals = 0
+        total_xg = 0
             
-            for match in results:
-                if match["h"]["title"] == team_name:
-                    if match["goals"]["h"] is not None and match["xG"]["h"] is not None:
-                        total_goals += int(match["goals"]["h"])
-                        total_xg += float(match["xG"]["h"])
-                else:
-                    if match["goals"]["a"] is not None and match["xG"]["a"] is not None:
-                        total_goals += int(match["goals"]["a"])
-                        total_xg += float(match["xG"]["a"])
+        for match in results:
+            if match["h"]["title"] == team_name:
+                if match["goals"]["h"] is not None and match["xG"]["h"] is not None:
+                    total_goals += int(match["goals"]["h"])
+                    total_xg += float(match["xG"]["h"])
+            else:
+                if match["goals"]["a"] is not None and match["xG"]["a"] is not None:
+                    total_goals += int(match["goals"]["a"])
+                    total_xg += float(match["xG"]["a"])
             
-            # if not enough data
-            if total_xg < 1.0:
-                return 1.0
+        # if not enough data
+        if total_xg < 1.0:
+            return 1.0
                 
-            # Calculate ratio and cap between 0.7 and 1.3 
-            ratio = total_goals / total_xg
-            return max(0.7, min(1.3, ratio))
+        # Calculate ratio and cap between 0.7 and 1.3 
+        ratio = total_goals / total_xg
+        return max(0.7, min(1.3, ratio))
     """
     # Moving route stuff to here
-    async def predict_match(self, match_id, league_code, season):
-        """Generate match prediction with all factors"""
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
+    async def predict_match(self, match_id, league_code, season, context=None):
+        """Generate match prediction with all factors. Pass the request's MatchContext to share its fetches."""
+        if context is None:
+            context = MatchContext(match_id, league_code, season)
             
-            # Get match details
-            fixtures = await understat.get_league_fixtures(league_code, season)
-            match = next((fixture for fixture in fixtures if fixture["id"] == match_id), None)
+        # Get match details
+        entry = await context.get_match()
             
-            if not match:
-                return None
+        # Only upcoming fixtures can be predicted
+        if not entry or entry["is_result"]:
+            return None
+        match = entry["match"]
+        league_code = entry["league"]
+        season = entry["season"]
                 
-            home_team = match["h"]["title"]
-            away_team = match["a"]["title"]
-            
-            league_positions = await self.get_league_positions(league_code, season)
-            
-            # New dict with everything reduce calls
-            home_data = await self.get_team_recent_data(home_team, league_code, season)
-            away_data = await self.get_team_recent_data(away_team, league_code, season)
+        home_team = match["h"]["title"]
+        away_team = match["a"]["title"]
             
-            # Extract xG performance ratios
-            home_xg_performance = home_data["xg_performance"]
-            away_xg_performance = away_data["xg_performance"]
+        # Table and both teams' form don't depend on each other so fetch them together
+        league_positions, home_data, away_data = await asyncio.gather(
+            self.get_league_positions(league_code, season, context),
+            self.get_team_recent_data(home_team, league_code, season, context),
+            self.get_team_recent_data(away_team, league_code, season, context)
+        )
             
-            # Calculate base expected scores with xG performance adjustment
-            home_expected = self.calculate_expected_score(home_data["xg"], home_xg_performance)
-            away_expected = self.calculate_expected_score(away_data["xg"], away_xg_performance)
-            
-            # Adjust for opposition strength
-            # Accessed through home_data y ... etc now. 
-            home_opposition_positions = [league_positions.get(team, 10) for team in home_data["opponents"]]
-            away_opposition_positions = [league_positions.get(team, 10) for team in away_data["opponents"]]
+        home_expected, away_expected = self.calculate_expected_goals(home_data, away_data, league_positions)
+        # Calculate win probabilities
+        probabilities = self.calculate_probabilities(home_expected, away_expected)
+        return self.build_prediction(match, league_code, season, league_positions, home_data, away_data,
+                                     home_expected, away_expected, probabilities)
+
+    async def predict_matchday(self, league_code, season):
+        """
+        Predict every upcoming fixture in a league in one pass. The table and each team's form are
+        fetched once and shared, and all the probabilities come from one batched engine call.
+        """
+        understat = get_understat_client()
+        fixtures = await understat.get_league_fixtures(league_code, season)
+        if not fixtures:
+            return []
+
+        teams = sorted({fixture["h"]["title"] for fixture in fixtures} | {fixture["a"]["title"] for fixture in fixtures})
+        league_positions, *team_data = await asyncio.gather(
+            self.get_league_positions(league_code, season),
+            *(self.get_team_recent_data(team, league_code, season) for team in teams)
+        )
+        team_data = dict(zip(teams, team_data))
+
+        expected = [
+            self.calculate_expected_goals(team_data[fixture["h"]["title"]], team_data[fixture["a"]["title"]], league_positions)
+            for fixture in fixtures
+        ]
+        probabilities = self.calculate_probabilities_batch([e[0] for e in expected], [e[1] for e in expected])
+
+        return [
+            self.build_prediction(fixture, league_code, season, league_positions,
+                                  team_data[fixture["h"]["title"]], team_data[fixture["a"]["title"]],
+                                  home_expected, away_expected, fixture_probabilities)
+            for fixture, (home_expected, away_expected), fixture_probabilities in zip(fixtures, expected, probabilities)
+        ]
+
+    def calculate_expected_goals(self, home_data, away_data, league_positions):
+        """Expected goals for both sides from recent xG, finishing and strength of opposition"""
+        # Calculate base expected scores with xG performance adjustment
+        home_expected = self.calculate_expected_score(home_data["xg"], home_data["xg_performance"])
+        away_expected = self.calculate_expected_score(away_data["xg"], away_data["xg_performance"])
             
-            home_expected = self.adjust_for_opposition(home_expected, home_opposition_positions)
-            away_expected = self.adjust_for_opposition(away_expected, away_opposition_positions)
+        # Adjust for opposition strength
+        # Accessed through home_data y ... etc now. 
+        home_opposition_positions = [league_positions.get(team, 10) for team in home_data["opponents"]]
+        away_opposition_positions = [league_positions.get(team, 10) for team in away_data["opponents"]]
             
+        home_expected = self.adjust_for_opposition(home_expected, home_opposition_positions)
+        away_expected = self.adjust_for_opposition(away_expected, away_opposition_positions)
+        return home_expected, away_expected
+
+    def build_prediction(self, match, league_code, season, league_positions, home_data, away_data,
+                         home_expected, away_expected, probabilities):
+        """Everything the prediction page shows for one match"""
+        # Fingerprint of the inputs so a stored prediction can tell if the data it came from has changed
+        data_version = hashlib.sha1(
+            json.dumps([league_positions, home_data, away_data], sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+
+        return {
+            "match": match,
+            "league_code": league_code,
+            "season": season,
+            "home_xg": home_data["xg"],
+            "away_xg": away_data["xg"],
+            "home_goals": home_data["goals"],
+            "away_goals": away_data["goals"],
+            "home_opponents": home_data["opponents"],
+            "away_opponents": away_data["opponents"],
+            "home_dates": home_data["dates"],
+            "away_dates": away_data["dates"],
+            "home_results": home_data["results"],
+            "away_results": away_data["results"],
+            "home_xg_performance": home_data["xg_performance"],
+            "away_xg_performance": away_data["xg_performance"],
+            "home_expected": home_expected,
+            "away_expected": away_expected,
             # Round score for AI prediction
-            home_score = round(home_expected)
-            away_score = round(away_expected)
-            
-            # Calculate win probabilities
-            probabilities = self.calculate_probabilities(home_expected, away_expected)
-            
-            return {
-                "match": match,
-                "home_xg": home_data["xg"],
-                "away_xg": away_data["xg"],
-                "home_goals": home_data["goals"],
-                "away_goals": away_data["goals"],
-                "home_opponents": home_data["opponents"],
-                "away_opponents": away_data["opponents"],
-                "home_dates": home_data["dates"],
-                "away_dates": away_data["dates"],
-                "home_results": home_data["results"],
-                "away_results": away_data["results"],
-                "home_xg_performance": home_xg_performance,
-                "away_xg_performance": away_xg_performance,
-                "home_expected": home_expected,
-                "away_expected": away_expected,
-                "prediction": {"home": home_score, "away": away_score},
-                "probabilities": probabilities
-            }   
+            "prediction": {"home": round(home_expected), "away": round(away_expected)},
+            "probabilities": probabilities,
+            "league_positions": league_positions,
+            "data_version": data_version
+        }   
     """User will alter his bet live IN the webapp. It NEEDS to update odds then and there... This will be moved to js"""
         
         # Server will use this when adding to DB... JS mirrors it
@@ -260,49 +307,54 @@ class PredictionSystem:
     
     def calculate_probabilities(self, home_expected, away_expected):
         """Calculate win/draw/loss probabilities"""
-        home_probs = {}
-        away_probs = {}
-        
-        # Calculate goal probabilities for each team fix so
-        for i in range(7):
-            home_probs[i] = poisson_probability(i, home_expected)
-            away_probs[i] = poisson_probability(i, away_expected)
-        
-        # Calculate match outcome probabilities
-        home_win_prob = 0
-        draw_prob = 0
-        away_win_prob = 0
-        
-        # Sum probabilities for each outcome
-        for home_goals in range(7):
-            for away_goals in range(7):
-                prob = home_probs[home_goals] * away_probs[away_goals]
-                
-                if home_goals > away_goals:
-                    home_win_prob += prob
-                elif home_goals == away_goals:
-                    draw_prob += prob
-                else:
-                    away_win_prob += prob
-        
-        # Apply home advantage adjustment for home win
-        home_edge = 0.05  # 5% home advantage
-        home_win_prob = min(home_win_prob + home_edge, 0.9)
-        
-        #  sum to 1
-        total = home_win_prob + draw_prob + away_win_prob
-        home_win_prob /= total
-        draw_prob /= total
-        away_win_prob /= total
-        
-        return {
-            "home_win": round(home_win_prob * 100, 1),
-            "draw": round(draw_prob * 100, 1),
-            "away_win": round(away_win_prob * 100, 1)
-        }
-    
+        return self.calculate_probabilities_batch([home_expected], [away_expected])[0]
+
+    def calculate_probabilities_batch(self, home_expected, away_expected):
+        """Same as calculate_probabilities for lots of matches in one go, e.g. a whole matchday"""
+        engine = scoreline_probabilities(home_expected, away_expected, self.max_goals, self.max_goals)
+        return [
+            {
+                "home_win": round(float(home_win) * 100, 1),
+                "draw": round(float(draw) * 100, 1),
+                "away_win": round(float(away_win) * 100, 1)
+            }
+            for home_win, draw, away_win in zip(engine["home_win"], engine["draw"], engine["away_win"])
+        ]
     
-def poisson_probability(k, lambd):
-    return (math.exp(-lambd) * (lambd ** k)) / math.factorial(k)
     
-    
\ No newline at end of file
+HOME_EDGE = 0.05  # 5% home advantage added to the home win chance
+MAX_HOME_WIN = 0.9  # before normalising
+
+def poisson_matrix(expected, max_goals):
+    """One row per match: chance of scoring 0..max_goals goals"""
+    expected = np.asarray(expected, dtype=float).reshape(-1, 1)
+    goals = np.arange(max_goals + 1)
+    factorials = np.array([math.factorial(k) for k in goals], dtype=float)
+    return np.exp(-expected) * expected ** goals / factorials
+
+def scoreline_probabilities(home_expected, away_expected, max_home_goals=6, max_away_goals=6):
+    """
+    Poisson scoreline model for many matches at once. home_expected/away_expected are same length lists/arrays.
+    Returns "matrices" (n, max_home_goals+1, max_away_goals+1) where [i, h, a] is the chance match i ends h-a,
+    plus "home_win", "draw", "away_win" arrays (0-1) with the home edge applied and normalised like before.
+    """
+    home_pmf = poisson_matrix(home_expected, max_home_goals)
+    away_pmf = poisson_matrix(away_expected, max_away_goals)
+    matrices = home_pmf[:, :, None] * away_pmf[:, None, :]
+
+    home_goals = np.arange(max_home_goals + 1)[:, None]
+    away_goals = np.arange(max_away_goals + 1)[None, :]
+    home_win = (matrices * (home_goals > away_goals)).sum(axis=(1, 2))
+    draw = (matrices * (home_goals == away_goals)).sum(axis=(1, 2))
+    away_win = (matrices * (home_goals < away_goals)).sum(axis=(1, 2))
+
+    # Apply home advantage adjustment for home win then make them sum to 1
+    home_win = np.minimum(home_win + HOME_EDGE, MAX_HOME_WIN)
+    total = home_win + draw + away_win
+
+    return {
+        "matrices": matrices,
+        "home_win": home_win / total,
+        "draw": draw / total,
+        "away_win": away_win / total
+    }
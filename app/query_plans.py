@@ -0,0 +1,67 @@
+from .models import get_db_connection, LEADERBOARD_QUERY, RECENT_LEAGUE_BETS_QUERY
+
+'''QUERY PLAN CHECK'''
+# The queries that run on every bet, page view or settlement, with example parameters. "flask --app run
+# explain-queries" prints EXPLAIN QUERY PLAN for each one and flags full table scans, run it after adding
+# a query here or changing an index in migrations.py.
+
+HOT_QUERIES = [
+    ("pending match bets", "SELECT DISTINCT match_id FROM user_predictions WHERE points_earned IS NULL", ()),
+    ("pending player bets", "SELECT DISTINCT match_id FROM user_player_predictions WHERE points_earned IS NULL", ()),
+    ("settle match bets", """
+        SELECT id, user_id, league_id, home_score, away_score, bet_amount,
+               potential_exact_points, potential_result_points, outcome_prediction
+        FROM user_predictions WHERE match_id = ? AND points_earned IS NULL
+    """, ("1",)),
+    ("settle player bets", """
+        SELECT id, user_id, league_id, player_id, goals_prediction, shots_prediction, bet_amount, potential_points
+        FROM user_player_predictions WHERE match_id = ? AND points_earned IS NULL
+    """, ("1",)),
+    ("process_match_bets", "SELECT id, user_id, league_id, bet_amount, outcome_prediction, home_score, away_score FROM user_predictions WHERE match_id = ?", ("1",)),
+    ("user predictions", "SELECT * FROM user_predictions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (1, 10)),
+    ("user player predictions", "SELECT * FROM user_player_predictions WHERE user_id = ? ORDER BY created_at DESC", (1,)),
+    ("bet history", "SELECT * FROM all_user_predictions WHERE user_id = ? ORDER BY created_at DESC LIMIT ?", (1, 10)),
+    ("player bet history", "SELECT * FROM all_user_player_predictions WHERE user_id = ? ORDER BY created_at DESC", (1,)),
+    ("user player predictions for match", "SELECT * FROM user_player_predictions WHERE user_id = ? AND match_id = ? ORDER BY created_at DESC", (1, "1")),
+    ("bet debit", "UPDATE league_scores SET score = score - ? WHERE user_id = ? AND league_id = ? AND score >= ?", (50, 1, 1, 50)),
+    ("recent league bets feed", RECENT_LEAGUE_BETS_QUERY, (1, None, None, None, 5)),
+    ("league score", "SELECT score FROM league_scores WHERE user_id = ? AND league_id = ?", (1, 1)),
+    ("top score in league", "SELECT MAX(score) FROM league_scores WHERE league_id = ?", (1,)),
+    ("leaderboard page", LEADERBOARD_QUERY, (1, 1, 50, 0)),
+    ("leaderboard rank shift", "UPDATE leaderboard SET rank = rank + 1 WHERE league_id = ? AND user_id != ? AND score >= ? AND score < ?", (1, 1, 1000, 1050)),
+    ("my rank neighbours above", """
+        SELECT u.username, l.score FROM leaderboard l JOIN users u ON u.id = l.user_id
+        WHERE l.league_id = ? AND (l.rank, l.user_id) < (?, ?) ORDER BY l.rank DESC, l.user_id DESC LIMIT ?
+    """, (1, 10, 5, 2)),
+    ("my rank neighbours below", """
+        SELECT u.username, l.score FROM leaderboard l JOIN users u ON u.id = l.user_id
+        WHERE l.league_id = ? AND (l.rank, l.user_id) > (?, ?) ORDER BY l.rank, l.user_id LIMIT ?
+    """, (1, 10, 5, 2)),
+    ("leaderboard higher scores", "SELECT COUNT(*) FROM leaderboard WHERE league_id = ? AND score > ?", (1, 1000)),
+    ("ledger balance tail", "SELECT SUM(delta) FROM points_ledger WHERE user_id = ? AND league_id = ? AND id > ?", (1, 1, 0)),
+    ("ledger context", "INSERT OR REPLACE INTO ledger_context (id, reason, reference_id) VALUES (1, ?, ?)", ("bet", "1")),
+    ("user leagues", """
+        SELECT f.id FROM users u JOIN league_members m ON m.user_id = u.id
+        JOIN fantasyLeagues f ON f.id = m.league_id WHERE u.username = ?
+    """, ("someone",)),
+    ("is user in league", "SELECT 1 FROM league_members m JOIN users u ON u.id = m.user_id WHERE u.username = ? AND m.league_id = ?", ("someone", 1)),
+]
+
+def is_table_scan(detail):
+    # "SCAN x USING (COVERING) INDEX" walks an index, only a bare SCAN reads the whole table
+    return detail.startswith("SCAN") and "INDEX" not in detail
+
+def explain_hot_queries():
+    """[(name, [plan detail lines], has_table_scan)] for every query in HOT_QUERIES"""
+    conn = get_db_connection()
+    report = []
+    if conn is not None:
+        try:
+            c = conn.cursor()
+            for name, sql, params in HOT_QUERIES:
+                c.execute("EXPLAIN QUERY PLAN " + sql, params)
+                details = [row[3] for row in c.fetchall()]
+                report.append((name, details, any(is_table_scan(detail) for detail in details)))
+        finally:
+            conn.close()
+    return report
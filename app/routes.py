@@ -1,3 +1,4 @@
+import asyncio
 import os
 import uuid
 from flask import Flask, Blueprint, render_template, request, redirect, url_for, session, flash, jsonify
@@ -6,62 +7,42 @@ from flask_wtf import FlaskForm
 from wtforms import FileField, SelectField, StringField, PasswordField, SubmitField, IntegerField
 from wtforms.validators import DataRequired, Length, EqualTo, NumberRange
 from werkzeug.utils import secure_filename
-from .models import get_user, update_user, add_user, user_exists, init_db, verify_password, add_fantasy_league, get_league_by_code, get_public_leagues, save_prediction, get_user_predictions, get_league_by_id, get_user_leagues, is_user_in_league, add_user_to_league, get_league_leaderboard, place_bet, get_profile_pic, get_db_connection, get_user_player_predictions, save_player_prediction, ensure_user_in_global_league, get_seasonal_league_leaderboard, get_recent_league_bets, process_all_bets
+from .models import get_user, add_user, user_exists, verify_password, add_fantasy_league, get_league_by_code, get_public_leagues, get_league_by_id, add_user_to_league, get_user_rank, place_bet, ensure_user_in_global_league, process_all_bets
+from .identity import current_user, current_user_leagues, current_user_league_ids, forget_current_user, load_current_user
+from . import async_models
 from .player_prediction_model import PlayerPredictionSystem
-import aiohttp
-from understat import Understat # https://github.com/amosbastian/understat
+from .understat_client import get_understat_client
+from .leagues import LEAGUE_MAPPING, LEAGUE_ICONS, DEFAULT_LEAGUE, CURRENT_SEASON
+from .match_context import MatchContext
 import json
 from datetime import datetime
 
 main = Blueprint('main', __name__)
 app = Flask(__name__)
 
-LEAGUE_MAPPING = {
-    "epl": "Premier League",
-    "La_liga": "La Liga",
-    "Bundesliga": "Bundesliga", 
-    "Serie_A": "Serie A",
-    "Ligue_1": "Ligue 1"
-}
-
-LEAGUE_ICONS = {
-    "epl": "PremLogo.png",
-    "La_liga": "LaLigaLogo.png",
-    "Bundesliga": "BundesligaLogo.png",
-    "Serie_A": "SerieALogo.png", 
-    "Ligue_1": "Ligue1Logo.png"
-}
-
-DEFAULT_LEAGUE = "epl"
-
 UPLOAD_FOLDER = 'app/static/profilepics/'
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# Schema is set up by migrations.migrate() in create_app, nothing runs before each request
+
 
-    # Initialize database before the first request
-@main.before_app_request
-def initialise_database():
-    init_db()
-    
-    
 @main.route('/')
 async def homepage():
     for league_code in LEAGUE_MAPPING:
         league_name = LEAGUE_MAPPING[league_code]
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
-            table = await understat.get_league_table(league_code, 2024, with_headers=False)
-            results = await understat.get_league_results(league_code, 2024)
-            recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
-            fixtures = await understat.get_league_fixtures(league_code, 2024)
-            upcoming_fixtures = sorted(fixtures, key=lambda x: x["datetime"])[:5]
-            return render_template("main.html",  # change it if you want. dont bother
-                            league_name=league_name,
-                            league_code=league_code,
-                            table=table,
-                            recent_results=recent_results,
-                            upcoming_fixtures=upcoming_fixtures)
+        understat = get_understat_client()
+        table = await understat.get_league_table(league_code, CURRENT_SEASON, with_headers=False)
+        results = await understat.get_league_results(league_code, CURRENT_SEASON)
+        recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
+        fixtures = await understat.get_league_fixtures(league_code, CURRENT_SEASON)
+        upcoming_fixtures = sorted(fixtures, key=lambda x: x["datetime"])[:5]
+        return render_template("main.html",  # change it if you want. dont bother
+                        league_name=league_name,
+                        league_code=league_code,
+                        table=table,
+                        recent_results=recent_results,
+                        upcoming_fixtures=upcoming_fixtures)
 
 
 
@@ -73,22 +54,21 @@ async def league_view(league_code=DEFAULT_LEAGUE):
         league_code = DEFAULT_LEAGUE
     league_name = LEAGUE_MAPPING[league_code]
     
-    async with aiohttp.ClientSession() as session:
-        understat = Understat(session)
-        table = await understat.get_league_table(league_code, 2024, with_headers=False)
+    understat = get_understat_client()
+    table = await understat.get_league_table(league_code, CURRENT_SEASON, with_headers=False)
         
-        results = await understat.get_league_results(league_code, 2024)
-        recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
+    results = await understat.get_league_results(league_code, CURRENT_SEASON)
+    recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
         
-        fixtures = await understat.get_league_fixtures(league_code, 2024)
-        upcoming_fixtures = sorted(fixtures, key=lambda x: x["datetime"])[:5]
-    
-        return render_template("PremierLeague.html",  # change it if you want. dont bother
-                        league_name=league_name,
-                        league_code=league_code,
-                        table=table,
-                        recent_results=recent_results,
-                        upcoming_fixtures=upcoming_fixtures)
+    fixtures = await understat.get_league_fixtures(league_code, CURRENT_SEASON)
+    upcoming_fixtures = sorted(fixtures, key=lambda x: x["datetime"])[:5]
+    
+    return render_template("PremierLeague.html",  # change it if you want. dont bother
+                    league_name=league_name,
+                    league_code=league_code,
+                    table=table,
+                    recent_results=recent_results,
+                    upcoming_fixtures=upcoming_fixtures)
 # if anything leaking around:
 @main.route('/PremierLeague')
 def premier_league_redirect():
@@ -143,10 +123,11 @@ def join_league():
         if league:
             league_id = league["id"]
 
-            if is_user_in_league(username, league_id):
+            if league_id in current_user_league_ids():
                 flash("You are already a member of this league")
             else:
                 if add_user_to_league(username, league_id):
+                    forget_current_user("leagues")
                     flash(f"Successfully joined private league: {league['league_name']}", "success")
                 else:
                     flash("Error joining league. Try again")
@@ -156,8 +137,7 @@ def join_league():
         return redirect(url_for("main.join_league"))
 
     public_leagues = get_public_leagues()
-    user_leagues_list = get_user_leagues(username)
-    user_league_ids = [str(league['id']) for league in user_leagues_list]
+    user_league_ids = [str(league_id) for league_id in current_user_league_ids()]
 
     return render_template("joinLeague.html", leagues=public_leagues, user_leagues=user_league_ids)
 
@@ -173,10 +153,11 @@ def join_public_league(league_id):
     league = get_league_by_id(league_id)
 
     if league:
-        if is_user_in_league(username, league_id):
+        if league_id in current_user_league_ids():
             flash("You are already a member of this league")
         else:
             if add_user_to_league(username, league_id):
+                forget_current_user("leagues")
                 flash(f"Successfully joined league: {league['league_name']}")
             else:
                 flash("Error joining league")
@@ -187,24 +168,47 @@ def join_public_league(league_id):
 
 
 
+MEMBER_LIST_LIMIT = 30
+RECENT_BETS_LIMIT = 5
+
+async def upcoming_league_bets(league_id, limit=RECENT_BETS_LIMIT, cursor=None):
+    """Latest bet per match in a league for matches that haven't been played yet, plus the cursor for
+    the next page ("created_at|match_id", None at the end)"""
+    before = tuple(cursor.split("|", 1)) if cursor else None
+    bets = await async_models.get_recent_league_bets(league_id, limit, before)
+    # All the matches at once from the match index / mirror, any league
+    matches = await get_understat_client().find_matches(bet["match_id"] for bet in bets)
+    upcoming = []
+    for bet in bets:
+        entry = matches.get(str(bet["match_id"]))
+        # match still a fixture
+        if entry and not entry["is_result"]:
+            bet["match"] = entry["match"]
+            upcoming.append(bet)
+    next_cursor = f"{bets[-1]['created_at']}|{bets[-1]['match_id']}" if len(bets) == limit else None
+    return upcoming, next_cursor
+
 #called when user clicks on league name
 @main.route("/league/<int:league_id>")
 async def league(league_id):
-    league = get_league_by_id(league_id)
+    league = await async_models.get_league_by_id(league_id)
     if not league:
         flash("League not found")
         return redirect(url_for("main.join_league"))
 
     league_type = league.get("league_type")
-    members_str = league.get("members", "")
-    member_list = [x.strip() for x in members_str.split(",") if x.strip()] if members_str else []
-    league["member_list"] = member_list
-
-    if league_type == "classic":
-        league["leaderboard"] = get_league_leaderboard(league_id)
-    elif league_type == "seasonal":
-        league["leaderboard"] = get_seasonal_league_leaderboard(league_id)
+    # The global league has everyone in it, so only the first few members and one page of the leaderboard.
+    # Both load on the DB thread pool at once
+    members = async_models.get_league_members(league_id, limit=MEMBER_LIST_LIMIT)
+    if league_type in ("classic", "seasonal"):
+        leaderboard = async_models.get_league_leaderboard(league_id, page=request.args.get("page", 1, type=int), username=session.get("username"))
+        league["member_list"], leaderboard_page = await asyncio.gather(members, leaderboard)
+        league["leaderboard"] = leaderboard_page["leaderboard"]
+        league["leaderboard_page"] = leaderboard_page
+    else:
+        league["member_list"] = await members
 
+    if league_type == "seasonal":
         if league.get("season_end"):
             season_end_str = league["season_end"]
             try:
@@ -223,47 +227,32 @@ async def league(league_id):
         else:
             league["time_left"] = 0
 
-    else:
+    elif league_type != "classic":
         flash("error creating league leaderboard")
     
     recent_bets = []
+    bets_cursor = None
     if league_type == "classic":
-        recent_bets_info = get_recent_league_bets(league_id)
-        
-        # Get match details for these bets
-        match_details = {}
-        async with aiohttp.ClientSession() as session:
-            understat = Understat(session)
-            fixtures = await understat.get_league_fixtures("epl", 2024)
-            results = await understat.get_league_results("epl", 2024)
-            
-            all_matches = fixtures + results
-            
-            # Get fixture IDs ezier
-            fixture_ids = [f["id"] for f in fixtures]
-            
-            for match in all_matches:
-                match_id = match["id"]
-                match_details[match_id] = match
-            
-        # Combine bet info with match details
-        for bet in recent_bets_info:
-            match_id = bet['match_id']
-            if match_id in match_details:
-                match = match_details[match_id]
-                # match still a fixture
-                if match_id in fixture_ids:
-                    bet['match'] = match
-                    recent_bets.append(bet)
-
-    return render_template("league.html", league=league, recent_bets=recent_bets)
+        recent_bets, bets_cursor = await upcoming_league_bets(league_id)
+
+    return render_template("league.html", league=league, recent_bets=recent_bets, bets_cursor=bets_cursor)
+
+@main.route("/api/league-bets/<int:league_id>")
+async def league_bets(league_id):
+    """Next page of a league's recent bets feed, pass back next_cursor as ?cursor= to keep scrolling"""
+    if "username" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 403
+
+    limit = min(max(request.args.get("limit", RECENT_BETS_LIMIT, type=int), 1), 50)
+    bets, next_cursor = await upcoming_league_bets(league_id, limit, request.args.get("cursor"))
+    return jsonify({"success": True, "bets": bets, "next_cursor": next_cursor})
 
 @main.route('/place_bet', methods=['POST'])
 def place_bet_route():
     if "username" not in session:
         return jsonify({"success": False, "message": "You must be logged in to bet"}), 403
 
-    user = get_user(session["username"])
+    user = current_user()
     if not user:
         return jsonify({"success": False, "message": "User not found"}), 404
     
@@ -291,20 +280,30 @@ async def league_update():
     if not league_id or not match_id:
         return jsonify({"success": False, "message": "Missing parameters"}), 400
 
-    async with aiohttp.ClientSession() as session_obj:
-        understat = Understat(session_obj)
-        results = await understat.get_league_results("epl", 2024)
-        match = next((result for result in results if result["id"] == match_id), None)
+    understat = get_understat_client()
+    entry = await understat.find_match(match_id)
         
-        if match:
-            home_goals = match["goals"]["h"]
-            away_goals = match["goals"]["a"]
-            from .models import process_match_bets
-            process_match_bets(match_id, home_goals, away_goals)
+    if entry and entry["is_result"]:
+        match = entry["match"]
+        home_goals = match["goals"]["h"]
+        away_goals = match["goals"]["a"]
+        await async_models.process_match_bets(match_id, home_goals, away_goals)
             
-    from .models import get_league_leaderboard
-    updated_leaderboard = get_league_leaderboard(league_id)
-    return jsonify({"success": True, "leaderboard": updated_leaderboard})
+    updated_leaderboard = await async_models.get_league_leaderboard(league_id, page=request.args.get("page", 1, type=int), username=session["username"])
+    return jsonify({"success": True, **updated_leaderboard})
+
+
+@main.route("/api/league-rank/<int:league_id>")
+def league_rank(league_id):
+    """The logged in user's rank, percentile and the people either side of them, for page headers"""
+    if "username" not in session:
+        return jsonify({"success": False, "message": "Not logged in"}), 403
+
+    neighbours = min(max(request.args.get("neighbours", 2, type=int), 0), 10)
+    rank = get_user_rank(league_id, session["username"], neighbours)
+    if rank is None:
+        return jsonify({"success": False, "message": "Not a member of this league"}), 404
+    return jsonify({"success": True, **rank})
 
 
 @main.route('/myLeagues')
@@ -313,8 +312,7 @@ def my_leagues():
         flash("You must be logged in to view your leagues!")
         return redirect(url_for("main.login"))
 
-    username = session["username"]
-    user_leagues = get_user_leagues(username)
+    user_leagues = current_user_leagues()
 
     return render_template("myLeagues.html", leagues=user_leagues)
 
@@ -330,26 +328,25 @@ async def fixtures(league_code=DEFAULT_LEAGUE, team_name=None):
     
     league_name = LEAGUE_MAPPING[league_code]
     
-    async with aiohttp.ClientSession() as session:
-        understat = Understat(session)
+    understat = get_understat_client()
         
-        if team_name:
-            results = await understat.get_team_results(team_name, 2024)
-            recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
+    if team_name:
+        results = await understat.get_team_results(team_name, CURRENT_SEASON)
+        recent_results = sorted(results, key=lambda x: x["datetime"], reverse=True)[:5]
             
-            fixtures = await understat.get_team_fixtures(team_name, 2024)
-            upcoming_fixtures = sorted(fixtures, key=lambda x: x["datetime"])[:5]
-            return render_template(
-                "fixtures.html",
-                league_code=league_code,
-                league_name=league_name,
-                team_name=team_name,
-                recent_results=recent_results,
-                upcoming_fixtures=upcoming_fixtures
-            )
-        return render_template("fixtures.html", 
-                              league_code=league_code, 
-                              league_name=league_name)
+        fixtures = await understat.get_team_fixtures(team_name, CURRENT_SEASON)
+        upcoming_fixtures = sorted(fixtures, key=lambda x: x["datetime"])[:5]
+        return render_template(
+            "fixtures.html",
+            league_code=league_code,
+            league_name=league_name,
+            team_name=team_name,
+            recent_results=recent_results,
+            upcoming_fixtures=upcoming_fixtures
+        )
+    return render_template("fixtures.html", 
+                          league_code=league_code, 
+                          league_name=league_name)
 
 class PredictionForm(FlaskForm):
     home_score = IntegerField('Home Score', validators=[
@@ -377,11 +374,18 @@ async def prediction(match_id, league_code=DEFAULT_LEAGUE):
     # Create a prediction system instance
     prediction_system = PredictionSystem()
     player_prediction_system = PlayerPredictionSystem()
-   
+    # Both systems and the template share this so each Understat dataset is fetched once per request
+    match_context = MatchContext(match_id, league_code, CURRENT_SEASON)
+    # Database reads start on the DB thread pool now and run while Understat is fetched below
+    user = await load_current_user()
+    stored_prediction = async_models.get_match_prediction(match_id)
+    if user:
+        player_bets = async_models.get_user_player_predictions(user["id"], match_id)
+        match_bets = async_models.get_user_predictions(user["id"])
     
     try:
         # Get player prediction data
-        player_data = await player_prediction_system.get_likely_match_players(match_id, league_code, 2024)
+        player_data = await player_prediction_system.get_likely_match_players(match_id, league_code, CURRENT_SEASON, match_context)
         
         # Process player data for template
         home_players = []
@@ -401,65 +405,72 @@ async def prediction(match_id, league_code=DEFAULT_LEAGUE):
             
         # Get user's existing player predictions if logged in
         user_player_predictions = {}
-        if "username" in session:
-            user = get_user(session["username"])
-            if user:
-                predictions = get_user_player_predictions(user["id"], match_id)
-                for pred in predictions:
-                    user_player_predictions[pred["player_id"]] = pred
+        if user:
+            predictions = await player_bets
+            for pred in predictions:
+                user_player_predictions[pred["player_id"]] = pred
     except Exception as e:
         import traceback
         print(f"Error getting player prediction data: {e}")
         print(traceback.format_exc())
+        if user:
+            async_models.discard(player_bets)
         home_players = []
         away_players = []
         user_player_predictions = {}
     
     # Get user's leagues so they can decide what league they wanna predict in 
-    user_leagues = []
-    if "username" in session:
-        user = get_user(session["username"])
-        if user:
-            user_leagues = get_user_leagues(session["username"])
+    user_leagues = current_user_leagues()
     
     try:
-        prediction_data = await prediction_system.predict_match(match_id, league_code, 2024)
+        # Normally already worked out by the refresh-predictions job, only recompute if missing or old
+        prediction_data = await stored_prediction
+        if prediction_data is None:
+            prediction_data = await prediction_system.predict_match(match_id, league_code, CURRENT_SEASON, match_context)
+            if prediction_data:
+                await async_models.save_match_predictions([prediction_data])
+        else:
+            entry = await match_context.get_match()
+            if not entry or entry["is_result"]:
+                prediction_data = None  # Kicked off since it was stored, no more betting on it
         print(f"DEBUG: Got prediction data: {bool(prediction_data)}")
-        for key in ["home_xg", "away_xg", "home_goals", "away_goals", 
-                   "home_opponents", "away_opponents", "home_dates", 
-                   "away_dates", "home_results", "away_results"]:
-            if key in prediction_data:
-                prediction_data[key] = list(reversed(prediction_data[key]))
+        if prediction_data:
+            for key in ["home_xg", "away_xg", "home_goals", "away_goals", 
+                       "home_opponents", "away_opponents", "home_dates", 
+                       "away_dates", "home_results", "away_results"]:
+                if key in prediction_data:
+                    prediction_data[key] = list(reversed(prediction_data[key]))
     except Exception as e:
         import traceback
         print(f"ERROR getting prediction data: {e}")
         print(traceback.format_exc())
         flash("Error retrieving match data", "error")
+        if user:
+            async_models.discard(match_bets)
         return redirect(url_for("main.fixtures", league_code=league_code))
     
     if not prediction_data:
         flash("Match not found", "error")
+        if user:
+            async_models.discard(match_bets)
         return redirect(url_for("main.fixtures", league_code=league_code))
         
     user_prediction = None
     
-    if "username" in session:
-        print(f"DEBUG: User in session: {session['username']}")
-        user = get_user(session["username"])
-        if user:
-            print(f"DEBUG: User ID: {user['id']}")
-            user_predictions = get_user_predictions(user["id"])
-            print(f"DEBUG: Found {len(user_predictions)} existing predictions")
-            for pred in user_predictions:
-                if pred["match_id"] == match_id:
-                    print(f"DEBUG: Found existing prediction for this match")
-                    user_prediction = {"home_score": pred["home_score"], "away_score": pred["away_score"]}
-
-                    if not form.home_score.data:
-                        form.home_score.data = pred["home_score"]
-                    if not form.away_score.data:
-                        form.away_score.data = pred["away_score"]
-                    break
+    if user:
+        print(f"DEBUG: User ID: {user['id']}")
+        user_predictions = await match_bets
+        print(f"DEBUG: Found {len(user_predictions)} existing predictions")
+        for pred in user_predictions:
+            if pred["match_id"] == match_id:
+                print(f"DEBUG: Found existing prediction for this match")
+                user_prediction = {"home_score": pred["home_score"], "away_score": pred["away_score"]}
+
+                if not form.home_score.data:
+                    form.home_score.data = pred["home_score"]
+                if not form.away_score.data:
+                    form.away_score.data = pred["away_score"]
+                break
     
     # Handle form  
     if "username" in session and request.method == "POST":
@@ -469,7 +480,6 @@ async def prediction(match_id, league_code=DEFAULT_LEAGUE):
             
     if "username" in session and form.validate_on_submit():
         try:
-            user = get_user(session["username"])
             if not user:
                 flash("User not found.", "danger")
                 return redirect(url_for("main.home"))
@@ -491,34 +501,6 @@ async def prediction(match_id, league_code=DEFAULT_LEAGUE):
                 flash("Bet amount must be between 10 and 500.", "danger")
                 return redirect(url_for("main.prediction", league_code=league_code, match_id=match_id))
             
-            # Check if user has enough points in the league
-            conn = get_db_connection()
-            c = conn.cursor()
-            c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = ?", (user["id"], league_id))
-            league_score = c.fetchone()
-            
-            if not league_score or league_score[0] < bet_amount:
-                flash(f"Insufficient points to place a bet of {bet_amount}.", "danger")
-                return redirect(url_for("main.prediction", league_code=league_code, match_id=match_id))
-                
-            # Deduct bet amount
-            new_score = league_score[0] - bet_amount
-            c.execute("UPDATE league_scores SET score = ? WHERE user_id = ? AND league_id = ?", 
-                      (new_score, user["id"], league_id))
-            conn.commit()
-            
-            # Also deduct from global league if this is not the global league
-            # Bet ALWAYS deducted from global league
-            if league_id != 1:
-                c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = 1", (user["id"],))
-                global_score = c.fetchone()
-                if global_score and global_score[0] >= bet_amount:
-                    new_global_score = global_score[0] - bet_amount
-                    c.execute("UPDATE league_scores SET score = ? WHERE user_id = ? AND league_id = 1", 
-                              (new_global_score, user["id"]))
-                    conn.commit()
-            
-         
             print(f"DEBUG: Prediction details - User ID: {user['id']}, Match ID: {match_id}")
             print(f"DEBUG: Home score: {home_score}, Away score: {away_score}")
             print(f"DEBUG: League ID: {league_id}, Bet Amount: {bet_amount}")
@@ -535,50 +517,16 @@ async def prediction(match_id, league_code=DEFAULT_LEAGUE):
             
             print(f"DEBUG: Points data: {points_data}")
             
-            # Convert match_id to string if it's not already
-            match_id_str = str(match_id)
-            
-            # Check if prediction already exists
-            c.execute("SELECT id FROM user_predictions WHERE user_id = ? AND match_id = ? AND league_id = ?", 
-                     (user["id"], match_id_str, league_id))
-            existing = c.fetchone()
-            
-            if existing:
-                # Update existing prediction
-                c.execute('''
-                    UPDATE user_predictions 
-                    SET home_score = ?, away_score = ?, bet_amount = ?, 
-                        multiplier = ?, potential_exact_points = ?, potential_result_points = ?, 
-                        created_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (home_score, away_score, bet_amount, 
-                      points_data["multiplier"], points_data["exact_score"], points_data["correct_result"], 
-                      existing[0]))
-            else:
-                # Insert new prediction
-                c.execute('''
-                    INSERT INTO user_predictions
-                    (user_id, match_id, home_score, away_score, bet_amount, 
-                     multiplier, potential_exact_points, potential_result_points, league_id)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (user["id"], match_id_str, home_score, away_score, bet_amount, 
-                      points_data["multiplier"], points_data["exact_score"], points_data["correct_result"], 
-                      league_id))
-            
-            conn.commit()
-            conn.close()
-            
-            # Also save to global league if this is not the global league
-            if league_id != 1:
-                save_to_global = save_prediction(
-                    user["id"], match_id_str, home_score, away_score, bet_amount, None,
-                    multiplier=points_data["multiplier"], 
-                    potential_exact_points=points_data["exact_score"],
-                    potential_result_points=points_data["correct_result"],
-                    league_id=1
-                )
-                if not save_to_global:
-                    print("WARNING: Failed to save prediction to global league")
+            # Balance check, debit and the bet in this league and the global league, all in one transaction
+            result = await async_models.place_bet(
+                user["id"], league_id, str(match_id), bet_amount, None, home_score, away_score,
+                multiplier=points_data["multiplier"],
+                potential_exact_points=points_data["exact_score"],
+                potential_result_points=points_data["correct_result"]
+            )
+            if not result["success"]:
+                flash(f"{result['message']}.", "danger")
+                return redirect(url_for("main.prediction", league_code=league_code, match_id=match_id))
             
             user_prediction = {"home_score": home_score, "away_score": away_score}
             flash("Your prediction has been saved!", "success")
@@ -612,7 +560,7 @@ async def prediction(match_id, league_code=DEFAULT_LEAGUE):
         away_xg_performance=prediction_data['away_xg_performance'],
         home_expected=prediction_data['home_expected'],
         away_expected=prediction_data['away_expected'],
-        league_positions=await prediction_system.get_league_positions(league_code, 2024),
+        league_positions=prediction_data['league_positions'],
         home_weight=prediction_system.home_weight, 
         user_prediction=user_prediction,
         home_players=home_players,
@@ -630,10 +578,16 @@ async def get_player_predictions(match_id, league_code=DEFAULT_LEAGUE):
         league_code = DEFAULT_LEAGUE
     player_prediction_system = PlayerPredictionSystem()
     
+    user_picks = None
     try:
-        player_data = await player_prediction_system.get_likely_match_players(match_id, league_code, 2024)
+        # The user's picks load while the players are fetched
+        user = await load_current_user()
+        if user:
+            user_picks = async_models.get_user_player_predictions(user["id"], match_id)
+        player_data = await player_prediction_system.get_likely_match_players(match_id, league_code, CURRENT_SEASON)
         
         if not player_data:
+            async_models.discard(user_picks)
             return jsonify({"error": "Match not found"})
             
         # Expected stats
@@ -642,15 +596,13 @@ async def get_player_predictions(match_id, league_code=DEFAULT_LEAGUE):
                 expected_stats = player_prediction_system.calculate_player_expected_stats(player)
                 player_data[team][i]["expected_stats"] = expected_stats
         
-        if "username" in session:
-            user = get_user(session["username"])
-            if user:
-                predictions = get_user_player_predictions(user["id"], match_id)
-                player_data["user_predictions"] = predictions
+        if user:
+            player_data["user_predictions"] = await user_picks
         
         return jsonify(player_data)
     # Error
     except Exception as e:
+        async_models.discard(user_picks)
         import traceback
         print(f"Error getting player predictions: {e}")
         print(traceback.format_exc())
@@ -666,7 +618,7 @@ async def save_player_predictions(match_id, league_code=DEFAULT_LEAGUE):
     if "username" not in session:
         return jsonify({"error": "You must be logged in to make predictions"})
     
-    user = get_user(session["username"])
+    user = await load_current_user()
     if not user:
         return jsonify({"error": "User not found"})
     
@@ -676,10 +628,9 @@ async def save_player_predictions(match_id, league_code=DEFAULT_LEAGUE):
         return jsonify({"error": "Invalid prediction data"})
     
     player_prediction_system = PlayerPredictionSystem()
-    conn = get_db_connection()
     
     # Get player data to calculate multipliers
-    player_data = await player_prediction_system.get_likely_match_players(match_id, league_code, 2024)
+    player_data = await player_prediction_system.get_likely_match_players(match_id, league_code, CURRENT_SEASON)
     
     # Create a map of player IDs to their data as a dict
     player_dict = {}
@@ -687,11 +638,11 @@ async def save_player_predictions(match_id, league_code=DEFAULT_LEAGUE):
         for player in player_data[team]:
             player_dict[player["id"]] = player
     
+    # One result per prediction in the order they came in, the valid ones get filled in once the slip is placed
     results = []
+    picks = []
     
     try:
-        c = conn.cursor()
-        
         for prediction in data:
             player_id = prediction.get("player_id")
             goals = prediction.get("goals", 0)
@@ -716,110 +667,33 @@ async def save_player_predictions(match_id, league_code=DEFAULT_LEAGUE):
                 })
                 continue
             
-            # Check if user has enough points in the league
-            c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = ?", 
-                     (user["id"], league_id))
-            league_score = c.fetchone()
-            
-            if not league_score or league_score[0] < bet_amount:
-                results.append({
-                    "player_id": player_id,
-                    "success": False,
-                    "message": f"Insufficient points to place a bet of {bet_amount}"
-                })
-                continue
-            
-            # Deduct bet amount from league score
-            new_score = league_score[0] - bet_amount
-            c.execute("UPDATE league_scores SET score = ? WHERE user_id = ? AND league_id = ?", 
-                     (new_score, user["id"], league_id))
-            
-            # Also deduct from global league if this is not the global league
-            if int(league_id) != 1:
-                c.execute("SELECT score FROM league_scores WHERE user_id = ? AND league_id = 1", (user["id"],))
-                global_score = c.fetchone()
-                if global_score and global_score[0] >= bet_amount:
-                    new_global_score = global_score[0] - bet_amount
-                    c.execute("UPDATE league_scores SET score = ? WHERE user_id = ? AND league_id = 1", 
-                             (new_global_score, user["id"]))
-            
             # Calculate points and multiplier (without minutes)
             player = player_dict[player_id]
-            points_data = player_prediction_system.calculate_points(
-                player, goals, shots, bet_amount
-            )
-            
-            # Check if prediction already exists
-            c.execute('''
-                SELECT id FROM user_player_predictions 
-                WHERE user_id = ? AND match_id = ? AND player_id = ? AND league_id = ?
-            ''', (user["id"], match_id, player_id, league_id))
-            existing = c.fetchone()
-            
-            if existing:
-                # Update existing prediction
-                c.execute('''
-                    UPDATE user_player_predictions 
-                    SET goals_prediction = ?, shots_prediction = ?, minutes_prediction = 0,
-                        multiplier = ?, potential_points = ?, bet_amount = ?, created_at = CURRENT_TIMESTAMP
-                    WHERE id = ?
-                ''', (goals, shots, points_data["multiplier"], points_data["potential_points"], 
-                      bet_amount, existing[0]))
-            else:
-                # Insert new prediction
-                c.execute('''
-                    INSERT INTO user_player_predictions
-                    (user_id, match_id, player_id, goals_prediction, shots_prediction, 
-                     minutes_prediction, multiplier, potential_points, league_id, bet_amount)
-                    VALUES (?, ?, ?, ?, ?, 0, ?, ?, ?, ?)
-                ''', (user["id"], match_id, player_id, goals, shots, 
-                     points_data["multiplier"], points_data["potential_points"], league_id, bet_amount))
-            
-            # Also save to global league if this is not the global league
-            if int(league_id) != 1:
-                # Check if prediction already exists in global league
-                c.execute('''
-                    SELECT id FROM user_player_predictions 
-                    WHERE user_id = ? AND match_id = ? AND player_id = ? AND league_id = 1
-                ''', (user["id"], match_id, player_id))
-                global_existing = c.fetchone()
-                
-                if global_existing:
-                    # Update existing prediction in global league
-                    c.execute('''
-                        UPDATE user_player_predictions 
-                        SET goals_prediction = ?, shots_prediction = ?, minutes_prediction = 0,
-                            multiplier = ?, potential_points = ?, bet_amount = ?, created_at = CURRENT_TIMESTAMP
-                        WHERE id = ?
-                    ''', (goals, shots, points_data["multiplier"], points_data["potential_points"], 
-                         bet_amount, global_existing[0]))
-                else:
-                    # Insert new prediction in global league
-                    c.execute('''
-                        INSERT INTO user_player_predictions
-                        (user_id, match_id, player_id, goals_prediction, shots_prediction, 
-                         minutes_prediction, multiplier, potential_points, league_id, bet_amount)
-                        VALUES (?, ?, ?, ?, ?, 0, ?, ?, 1, ?)
-                    ''', (user["id"], match_id, player_id, goals, shots, 
-                         points_data["multiplier"], points_data["potential_points"], bet_amount))
+            points_data = player_prediction_system.calculate_points(player, goals, shots)
             
-            results.append({
+            results.append(None)
+            picks.append({
                 "player_id": player_id,
-                "success": True,
+                "goals": goals,
+                "shots": shots,
+                "league_id": league_id,
+                "bet_amount": bet_amount,
                 "multiplier": points_data["multiplier"],
                 "potential_points": points_data["potential_points"]
             })
         
-        conn.commit()
+        # The whole slip in one transaction, a debit per league and one executemany for the picks
+        placed = await async_models.place_player_bets(user["id"], match_id, picks) if picks else []
+        if placed is None:
+            return jsonify({"error": "Error saving predictions"})
+        placed = iter(placed)
+        results = [result if result is not None else next(placed) for result in results]
         
     except Exception as e:
         import traceback
         print(f"Error saving player predictions: {e}")
         print(traceback.format_exc())
-        conn.rollback()
         return jsonify({"error": f"Error saving predictions: {str(e)}"})
-    finally:
-        conn.close()
     
     return jsonify({"results": results})
 
@@ -830,58 +704,54 @@ async def yourBets():
         flash("You must be logged in to view your bets", "danger")
         return redirect(url_for("main.login"))
     
-    user = get_user(flask_session["username"])
+    user = await load_current_user()
     if not user:
         flash("User not found", "danger")
         return redirect(url_for("main.home"))
     
-    predictions = get_user_predictions(user["id"])
-    player_predictions = get_user_player_predictions(user["id"])
-    
-    # Fetch leagues information for reference
-    league_info = {}
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute("SELECT id, league_name FROM fantasyLeagues")
-    leagues = c.fetchall()
-    conn.close()
-    
-    for league in leagues:
-        league_info[league[0]] = league[1]
+    # All three queries run at once on the DB thread pool
+    predictions, player_predictions, league_info = await asyncio.gather(
+        async_models.get_user_predictions(user["id"], include_archived=True),
+        async_models.get_user_player_predictions(user["id"], include_archived=True),
+        async_models.get_league_names()
+    )
     
     # Fetch match details for each prediction
     match_details = {}
     player_details = {}
     
-    async with aiohttp.ClientSession() as session:
-        understat = Understat(session)
-        fixtures = await understat.get_league_fixtures("epl", 2024)
-        results = await understat.get_league_results("epl", 2024)
-        
-        all_matches = fixtures + results
-        
-        for match in all_matches:
-            match_id = match["id"]
-            match_details[match_id] = {
-                "home_team": match["h"]["title"],
-                "away_team": match["a"]["title"],
-                "datetime": match["datetime"]
-            }
-            
-            # Get player details for matches with player predictions
-            match_player_predictions = [p for p in player_predictions if p["match_id"] == match_id]
-            if match_player_predictions:
-                try:
-                    match_players = await understat.get_match_players(match_id)
-                    for team in ["h", "a"]:
-                        if team in match_players:
-                            for player_data in match_players[team].values():
-                                player_details[player_data["player_id"]] = {
-                                    "name": player_data["player"],
-                                    "team": match[team]["title"]
-                                }
-                except Exception as e:
-                    print(f"Error fetching player data for match {match_id}: {e}")
+    understat = get_understat_client()
+    player_match_ids = {p["match_id"] for p in player_predictions}
+    bet_match_ids = {p["match_id"] for p in predictions} | player_match_ids
+
+    # Every bet's match in one batch (index/mirror first, each league list loaded at most once)
+    entries = await understat.find_matches(bet_match_ids)
+    for match_id, entry in entries.items():
+        match = entry["match"]
+        match_details[match_id] = {
+            "home_team": match["h"]["title"],
+            "away_team": match["a"]["title"],
+            "datetime": match["datetime"]
+        }
+
+    # Get player details for matches with player predictions, all at once
+    player_match_ids = [match_id for match_id in player_match_ids if match_id in entries]
+    lineups = await asyncio.gather(
+        *(understat.get_match_players(match_id) for match_id in player_match_ids),
+        return_exceptions=True
+    )
+    for match_id, match_players in zip(player_match_ids, lineups):
+        if isinstance(match_players, Exception):
+            print(f"Error fetching player data for match {match_id}: {match_players}")
+            continue
+        match = entries[match_id]["match"]
+        for team in ["h", "a"]:
+            if team in match_players:
+                for player_data in match_players[team].values():
+                    player_details[player_data["player_id"]] = {
+                        "name": player_data["player"],
+                        "team": match[team]["title"]
+                    }
     
     return render_template("yourBets.html", 
                           predictions=predictions, 
@@ -895,7 +765,7 @@ async def process_bets_route():
     if "username" not in session:
         return jsonify({"success": False, "message": "You must be logged in to process bets"}), 403
     
-    user = get_user(session["username"])
+    user = await load_current_user()
     if not user:
         return jsonify({"success": False, "message": "User not found"}), 404
     
@@ -916,46 +786,46 @@ async def single_result(match_id, league_code=DEFAULT_LEAGUE):
     if league_code not in LEAGUE_MAPPING:
         league_code = DEFAULT_LEAGUE
     
-    async with aiohttp.ClientSession() as session:
-        understat = Understat(session)
+    understat = get_understat_client()
         
-        results = await understat.get_league_results(league_code, 2024)
-        match = next((result for result in results if result["id"] == match_id), None)
+    entry = await understat.find_match(match_id, league_code)
         
-        if match:
-            match_players = await understat.get_match_players(match_id)
-            match_shots = await understat.get_match_shots(match_id)
-
-            home_stats = {
-                "shots": len(match_shots["h"]),
-                "shots_on_target": len([shot for shot in match_shots["h"]
-                                        if shot["result"] in ["SavedShot", "Goal"]]),
-                "goals": match["goals"]["h"],
-                "xG": float(match["xG"]["h"]),
-                "player_stats": match_players["h"]
-            }
-
-            away_stats = {
-                "shots": len(match_shots["a"]),
-                "shots_on_target": len([shot for shot in match_shots["a"]
-                                        if shot["result"] in ["SavedShot", "Goal"]]),
-                "goals": match["goals"]["a"],
-                "xG": float(match["xG"]["a"]),
-                "player_stats": match_players["a"]
-            }
+    if entry and entry["is_result"]:
+        match = entry["match"]
+        league_code = entry["league"]
+        match_players = await understat.get_match_players(match_id)
+        match_shots = await understat.get_match_shots(match_id)
+
+        home_stats = {
+            "shots": len(match_shots["h"]),
+            "shots_on_target": len([shot for shot in match_shots["h"]
+                                    if shot["result"] in ["SavedShot", "Goal"]]),
+            "goals": match["goals"]["h"],
+            "xG": float(match["xG"]["h"]),
+            "player_stats": match_players["h"]
+        }
+
+        away_stats = {
+            "shots": len(match_shots["a"]),
+            "shots_on_target": len([shot for shot in match_shots["a"]
+                                    if shot["result"] in ["SavedShot", "Goal"]]),
+            "goals": match["goals"]["a"],
+            "xG": float(match["xG"]["a"]),
+            "player_stats": match_players["a"]
+        }
                 
-            return render_template(
-                "singleResult.html",
-                league_code=league_code,
-                league_name=LEAGUE_MAPPING[league_code],
-                match=match,
-                home_stats=home_stats,
-                away_stats=away_stats,
-                match_shots=match_shots
-            )
-        else:
-            flash("Match not found", "error")
-            return redirect(url_for("main.fixtures", league_code=league_code))
+        return render_template(
+            "singleResult.html",
+            league_code=league_code,
+            league_name=LEAGUE_MAPPING[league_code],
+            match=match,
+            home_stats=home_stats,
+            away_stats=away_stats,
+            match_shots=match_shots
+        )
+    else:
+        flash("Match not found", "error")
+        return redirect(url_for("main.fixtures", league_code=league_code))
         
 
 # might not need this cos we have singleResult (takes match ID as param) 
@@ -982,6 +852,7 @@ def login():
 
         if user and verify_password(username, password):
             session["username"] = username  # Store user session
+            forget_current_user()
             
             # Ensure user is in global league
             ensure_user_in_global_league(user["id"], username)
@@ -997,6 +868,7 @@ def login():
 @main.route("/logout")
 def logout():
     session.pop("username", None)
+    forget_current_user()
     flash("Logged out!", "info")
     return redirect(url_for("main.login"))
 
@@ -1048,34 +920,35 @@ async def home():
     user = session["username"]
 
     form = UpdateForm()
-    db = get_db_connection()
     if request.method == "POST":
         user = session["username"]
         new_username = request.form.get('username')
         favourite_team = request.form.get('favourite_team')
         if user != new_username:
-            update_user(user, 'username', new_username)
+            await async_models.update_user(user, 'username', new_username)
             session["username"] = new_username
-        update_user(user, 'favourite_team', favourite_team)
+        await async_models.update_user(user, 'favourite_team', favourite_team)
 
         profile_pic = request.files.get('profile_pic')
         if profile_pic:
             pic_filename = secure_filename(profile_pic.filename)
             pic_name = str(uuid.uuid1()) + "_" + pic_filename
             profile_pic.save(os.path.join(app.config['UPLOAD_FOLDER'], pic_name))
-            update_user(user, 'profile_pic', pic_name)
+            await async_models.update_user(user, 'profile_pic', pic_name)
 
-        db.commit()
+        forget_current_user()
         flash("User Updated Successfully!")
         return redirect(url_for("main.home")) 
 
-    async with aiohttp.ClientSession() as understat_session:
-        understat = Understat(understat_session)
-        user = session["username"]
-        totalLeagues = len(get_user_leagues(user))
-        profile_pic = get_profile_pic(user)
-        teams = await understat.get_teams("epl", 2024)
-        form.favourite_team.choices = [(team['id'], team['title']) for team in teams]
+    understat = get_understat_client()
+    user = session["username"]
+    # The user and their leagues load while the team list is fetched
+    account, teams = await asyncio.gather(load_current_user(), understat.get_teams("epl", CURRENT_SEASON))
+    if not account:
+        return redirect(url_for("main.logout"))
+    totalLeagues = len(current_user_leagues())
+    profile_pic = "/static/profilepics/" + account["profile_pic"]
+    form.favourite_team.choices = [(team['id'], team['title']) for team in teams]
 
     return render_template("home.html", leagues=totalLeagues, form=form, profile_pic=profile_pic, username=user)
 
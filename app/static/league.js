@@ -1,18 +1,20 @@
 console.log("league.js loaded");
 
 function pollMatchResult() {
-  fetch(`/league_update?league_id=${leagueId}&match_id=${matchId}`)
+  fetch(`/league_update?league_id=${leagueId}&match_id=${matchId}&page=${leaderboardPage}`)
     .then(response => response.json())
     .then(data => {
       if (data.success && data.leaderboard) {
         const leaderboardTable = document.getElementById("leaderboard");
         if (leaderboardTable) {
           leaderboardTable.innerHTML = "";
-          data.leaderboard.forEach((player, index) => {
+          data.leaderboard.forEach(player => {
             const row = document.createElement("tr");
-            row.innerHTML = `<td>${index + 1}</td>
-                             <td>${player.username}</td>
-                             <td>${player.score}</td>`;
+            row.append(
+              textElement("td", "", player.rank),
+              textElement("td", "", player.username),
+              textElement("td", "", player.score)
+            );
             leaderboardTable.appendChild(row);
           });
         }
@@ -58,6 +60,64 @@ function placeBet(leagueId, matchId, prediction, button) {
   })
   .catch(error => console.error("Error placing bet:", error));
 }
+// usernames and team names come from users/Understat so they only ever go in as text, never as HTML
+function textElement(tag, className, text) {
+  const element = document.createElement(tag);
+  if (className) element.className = className;
+  element.textContent = text;
+  return element;
+}
+
+// recent bets feed, next page from the cursor the server gave us
+function loadMoreBets(button) {
+  fetch(`/api/league-bets/${leagueId}?cursor=${encodeURIComponent(button.dataset.cursor)}`)
+    .then(response => response.json())
+    .then(data => {
+      if (!data.success) return;
+      data.bets.forEach(bet => {
+        const item = document.createElement("div");
+        item.className = "match-item";
+
+        const info = document.createElement("div");
+        info.className = "recent-bet-info";
+        const time = textElement("span", "bet-time", bet.created_at.split(" ")[0]);
+        time.title = bet.created_at;
+        info.append(
+          textElement("span", "bet-user", bet.username), " predicted ",
+          textElement("span", "bet-score", `${bet.home_score} - ${bet.away_score}`), " ",
+          time
+        );
+
+        const link = document.createElement("a");
+        link.href = `/prediction/${encodeURIComponent(bet.match_id)}`;
+        link.className = "match-link";
+        const details = document.createElement("div");
+        details.className = "match-details";
+        const timeVs = document.createElement("div");
+        timeVs.className = "match-time-vs";
+        timeVs.append(
+          textElement("span", "match-time", bet.match.datetime.split(" ")[1].slice(0, 5)),
+          textElement("span", "match-vs", "VS")
+        );
+        details.append(
+          textElement("span", "team-name", bet.match.h.title),
+          timeVs,
+          textElement("span", "team-name", bet.match.a.title)
+        );
+        link.append(details);
+
+        item.append(info, link);
+        button.before(item);
+      });
+      if (data.next_cursor) {
+        button.dataset.cursor = data.next_cursor;
+      } else {
+        button.remove();
+      }
+    })
+    .catch(error => console.error("Error loading bets:", error));
+}
+
 // timer countdown
 if (typeof timeLeft !== 'undefined' && timeLeft > 0) {
   const countdownEl = document.getElementById('countdown');
@@ -0,0 +1,387 @@
+import asyncio
+import atexit
+import threading
+from datetime import datetime, timedelta
+import aiohttp
+from understat import Understat # https://github.com/amosbastian/understat
+from .cache import TTLCache
+from .understat_mirror import UnderstatMirror, MIRROR_DATABASE
+from .understat_replay import FixtureStore, MODES
+from .match_index import MatchIndex, INDEXED_ENDPOINTS
+from .leagues import LEAGUE_MAPPING, CURRENT_SEASON
+
+# How long (seconds) each kind of Understat data stays cached. None = until evicted.
+# Fixtures/tables/results change a few times a day, a finished match's players and shots never do.
+CACHE_TTLS = {
+    "get_league_fixtures": 30 * 60,
+    "get_league_results": 15 * 60,
+    "get_league_table": 15 * 60,
+    "get_teams": 24 * 60 * 60,
+    "get_team_results": 15 * 60,
+    "get_team_fixtures": 30 * 60,
+    "get_team_players": 60 * 60,
+    "get_match_players": None,
+    "get_match_shots": None
+}
+# How long a mirrored copy that's past its TTL is served for while a fresh one is fetched
+STALE_TTL = 60
+
+'''SHARED UNDERSTAT CLIENT'''
+# Flask runs every async view in its own short lived event loop, so a session made inside a view
+# dies with the request. This client keeps one pooled aiohttp session alive on a background loop
+# and every route / prediction system sends its Understat calls through it.
+class UnderstatClient:
+    def __init__(self, limit=30, limit_per_host=10, keepalive_timeout=60, request_timeout=20, cache_size=512, mirror=None,
+                 mode="live", fixture_dir=None, replay_latency=0.0):
+        if mode not in MODES:
+            raise ValueError(f"Unknown Understat mode {mode!r}, expected one of {MODES}")
+        if mode != "live" and not fixture_dir:
+            raise ValueError(f"Understat {mode} mode needs a fixture_dir")
+        self.limit = limit  # Max open connections overall
+        self.limit_per_host = limit_per_host  # Everything goes to understat.com so this is the real cap
+        self.keepalive_timeout = keepalive_timeout
+        self.request_timeout = request_timeout
+        self._loop = None
+        self._thread = None
+        self._session = None
+        self._lock = threading.Lock()
+        self.cache = TTLCache(maxsize=cache_size)
+        self._inflight = {}  # key -> task for fetches currently in progress (background loop only)
+        self._refreshing = {}  # key -> task refreshing a stale mirrored copy (background loop only)
+        self.coalesced = 0  # Requests that piggybacked on someone else's fetch
+        self.mirror = mirror  # UnderstatMirror or None to always go upstream
+        self.mode = mode  # live, record (save every response) or replay (serve saved responses, no network)
+        self.fixtures = FixtureStore(fixture_dir, replay_latency) if mode != "live" else None
+        self.matches = MatchIndex()
+
+    def _ensure_loop(self):
+        """Start the background event loop the pooled session lives on"""
+        with self._lock:
+            if self._loop is None or self._loop.is_closed():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name="understat-client", daemon=True)
+                self._thread.start()
+            return self._loop
+
+    async def _get_session(self):
+        """Create the pooled session on first use. Only ever runs on the background loop."""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=self.limit,
+                limit_per_host=self.limit_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+            timeout = aiohttp.ClientTimeout(total=self.request_timeout)
+            self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+        return self._session
+
+    async def _call(self, method, *args, **kwargs):
+        if self.mode == "replay":
+            return await self.fixtures.replay(method, args, kwargs)
+
+        session = await self._get_session()
+        understat = Understat(session)
+        result = await getattr(understat, method)(*args, **kwargs)
+
+        if self.mode == "record":
+            self.fixtures.save(method, args, kwargs, result)
+        return result
+
+    async def _run_blocking(self, func, *args):
+        """Mirror reads/writes are SQLite so keep them off the loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, func, *args)
+
+    def _index(self, method, args, kwargs, payload):
+        """Keep the match index up to date with any league fixtures/results list we see"""
+        if method in INDEXED_ENDPOINTS and not kwargs and payload:
+            self.matches.add_league(payload, args[0], args[1], INDEXED_ENDPOINTS[method])
+
+    async def _load(self, key, method, *args, **kwargs):
+        """Mirror first, Understat only if the mirror has nothing. A mirrored copy that's too old is
+        served as is and refreshed in the background, so a slow Understat never holds up a page."""
+        ttl = CACHE_TTLS.get(method, 15 * 60)
+        if self.mirror is not None:
+            mirrored = await self._run_blocking(self.mirror.get, method, args, kwargs)
+            if mirrored is not None:
+                payload, age = mirrored
+                if ttl is None or age < ttl:
+                    self.cache.set(key, payload, ttl - age if ttl is not None else None)
+                else:
+                    # Cached briefly so requests keep getting it while the refresh runs
+                    self.cache.set(key, payload, STALE_TTL)
+                    self._refresh_in_background(key, method, args, kwargs)
+                self._index(method, args, kwargs, payload)
+                return payload
+
+        result = await self._call(method, *args, **kwargs)
+        await self._store(key, method, args, kwargs, result)
+        return result
+
+    async def _store(self, key, method, args, kwargs, result):
+        """Cache, index and mirror a fresh Understat response. Returns whether the mirrored copy changed."""
+        # Don't cache empties, e.g. match players asked for before kick off
+        if not result:
+            return False
+        self.cache.set(key, result, CACHE_TTLS.get(method, 15 * 60))
+        self._index(method, args, kwargs, result)
+        if self.mirror is None:
+            return False
+        return await self._run_blocking(self.mirror.put, method, args, kwargs, result)
+
+    def _refresh_in_background(self, key, method, args, kwargs):
+        """Fetch a fresh copy of a stale mirrored response without anyone waiting on it (background loop only)"""
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                result = await self._call(method, *args, **kwargs)
+                await self._store(key, method, args, kwargs, result)
+            except Exception as e:
+                print(f"Understat {method}{args} failed ({e}), still serving mirrored copy")
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.ensure_future(refresh())
+
+    async def _single_flight(self, key, method, *args, **kwargs):
+        """Runs on the background loop. Everyone asking for the same key while a fetch
+        is already going waits on that one instead of sending their own request."""
+        cached = self.cache.peek(key)  # May have landed while this call hopped threads
+        if cached is not None:
+            return cached
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._load(key, method, *args, **kwargs))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        # Shield so one request giving up doesn't cancel the fetch for everyone else
+        return await asyncio.shield(task)
+
+    async def fetch(self, method, *args, **kwargs):
+        """Run an Understat method on the shared session and await the result from any event loop.
+        Results are cached and shared between requests so treat them as read only."""
+        key = (method, args, tuple(sorted(kwargs.items())))
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._single_flight(key, method, *args, **kwargs), loop)
+        return await asyncio.wrap_future(future)
+
+    async def fetch_upstream(self, method, *args, **kwargs):
+        """Always ask Understat, skipping the cache and the mirror. Used by the sync job."""
+        loop = self._ensure_loop()
+        future = asyncio.run_coroutine_threadsafe(self._call(method, *args, **kwargs), loop)
+        return await asyncio.wrap_future(future)
+
+    async def refresh(self, method, *args, **kwargs):
+        """Fetch from Understat and write through to the mirror and cache. Returns (result, changed)."""
+        result = await self.fetch_upstream(method, *args, **kwargs)
+        changed = await self._store((method, args, tuple(sorted(kwargs.items()))), method, args, kwargs, result)
+        return result, changed
+
+    async def find_match(self, match_id, league_code=None, season=CURRENT_SEASON):
+        """
+        Look a match up by id in any league. Returns {"match", "league", "season", "is_result"} or None.
+        Index first, then the mirror, and only then league lists (hinted league first).
+        """
+        entry = self.matches.get(match_id)
+        if entry is not None:
+            return entry
+
+        if self.mirror is not None:
+            entry = await asyncio.get_running_loop().run_in_executor(None, self.mirror.get_match, match_id)
+            if entry is not None:
+                self.matches.add(entry["match"], entry["league"], entry["season"], entry["is_result"])
+                return self.matches.get(match_id)
+
+        leagues = list(LEAGUE_MAPPING)
+        if league_code in leagues:
+            leagues.remove(league_code)
+            leagues.insert(0, league_code)
+        for league in leagues:
+            # Fetching these indexes them as a side effect
+            for method in INDEXED_ENDPOINTS:
+                try:
+                    await self.fetch(method, league, season)
+                except Exception as e:
+                    print(f"Error loading {method} for {league} while looking for match {match_id}: {e}")
+            entry = self.matches.get(match_id)
+            if entry is not None:
+                return entry
+        return None
+
+    async def find_matches(self, match_ids, league_code=None, season=CURRENT_SEASON, load_leagues=True):
+        """find_match for a batch of ids: {match_id: entry} for the ones that exist. The index and mirror
+        answer in one go, league lists are only loaded (once each) for ids neither of them know, and not
+        at all with load_leagues=False."""
+        found = {}
+        missing = []
+        for match_id in dict.fromkeys(str(match_id) for match_id in match_ids):
+            entry = self.matches.get(match_id)
+            if entry is not None:
+                found[match_id] = entry
+            else:
+                missing.append(match_id)
+
+        if missing and self.mirror is not None:
+            mirrored = await asyncio.get_running_loop().run_in_executor(None, self.mirror.get_matches, missing)
+            for match_id, entry in mirrored.items():
+                self.matches.add(entry["match"], entry["league"], entry["season"], entry["is_result"])
+                found[match_id] = self.matches.get(match_id)
+            missing = [match_id for match_id in missing if match_id not in found]
+
+        if missing and load_leagues:
+            leagues = list(LEAGUE_MAPPING)
+            if league_code in leagues:
+                leagues.remove(league_code)
+                leagues.insert(0, league_code)
+            for league in leagues:
+                for method in INDEXED_ENDPOINTS:
+                    try:
+                        await self.fetch(method, league, season)
+                    except Exception as e:
+                        print(f"Error loading {method} for {league} while looking for matches: {e}")
+                for match_id in missing:
+                    entry = self.matches.get(match_id)
+                    if entry is not None:
+                        found[match_id] = entry
+                missing = [match_id for match_id in missing if match_id not in found]
+                if not missing:
+                    break
+        return found
+
+    async def find_results(self, match_ids, timeout=None, played_after=timedelta(hours=2)):
+        """
+        Finished matches among match_ids, {match_id: match}, for settling bets. Only the league/season
+        results lists the matches belong to are refreshed from Understat (all at once, each with its own
+        timeout), and only when one of their matches should be over but is still a fixture here. Ids
+        nobody knows refresh every league's current season. A league that fails or times out leaves
+        its matches for the next run. Returns (results, [(league, season) that failed]).
+        """
+        match_ids = [str(match_id) for match_id in dict.fromkeys(match_ids)]
+        known = await self.find_matches(match_ids, load_leagues=False)
+
+        stale = set()
+        now = datetime.now()
+        for match_id in match_ids:
+            entry = known.get(match_id)
+            if entry is None:
+                stale.update((league, CURRENT_SEASON) for league in LEAGUE_MAPPING)
+            elif not entry["is_result"]:
+                kickoff = datetime.strptime(entry["match"]["datetime"], "%Y-%m-%d %H:%M:%S")
+                if kickoff + played_after <= now:
+                    stale.add((entry["league"], entry["season"]))
+
+        stale = sorted(stale)
+        timeout = timeout or self.request_timeout
+        outcomes = await asyncio.gather(
+            *(asyncio.wait_for(self.refresh("get_league_results", league, season), timeout) for league, season in stale),
+            return_exceptions=True
+        )
+        failed = []
+        for (league, season), outcome in zip(stale, outcomes):
+            if isinstance(outcome, BaseException):
+                print(f"Error refreshing results for {league} {season}: {outcome!r}")
+                failed.append((league, season))
+
+        results = {}
+        for match_id in match_ids:
+            entry = self.matches.get(match_id)
+            if entry is not None and entry["is_result"]:
+                results[match_id] = entry["match"]
+        return results, failed
+
+    def cache_stats(self):
+        stats = self.cache.stats()
+        stats["in_flight"] = len(self._inflight)
+        stats["coalesced"] = self.coalesced
+        return stats
+
+    # Same names as the Understat methods so call sites barely change
+    async def get_league_fixtures(self, league_name, season, **kwargs):
+        return await self.fetch("get_league_fixtures", league_name, season, **kwargs)
+
+    async def get_league_results(self, league_name, season, **kwargs):
+        return await self.fetch("get_league_results", league_name, season, **kwargs)
+
+    async def get_league_table(self, league_name, season, **kwargs):
+        return await self.fetch("get_league_table", league_name, season, **kwargs)
+
+    async def get_teams(self, league_name, season, **kwargs):
+        return await self.fetch("get_teams", league_name, season, **kwargs)
+
+    async def get_team_results(self, team_name, season, **kwargs):
+        return await self.fetch("get_team_results", team_name, season, **kwargs)
+
+    async def get_team_fixtures(self, team_name, season, **kwargs):
+        return await self.fetch("get_team_fixtures", team_name, season, **kwargs)
+
+    async def get_team_players(self, team_name, season, **kwargs):
+        return await self.fetch("get_team_players", team_name, season, **kwargs)
+
+    async def get_match_players(self, match_id, **kwargs):
+        return await self.fetch("get_match_players", match_id, **kwargs)
+
+    async def get_match_shots(self, match_id, **kwargs):
+        return await self.fetch("get_match_shots", match_id, **kwargs)
+
+    def close(self):
+        """Close the pooled session and stop the background loop. Safe to call more than once."""
+        with self._lock:
+            loop = self._loop
+            self._loop = None
+        if loop is None or loop.is_closed():
+            return
+        try:
+            if self._session is not None and not self._session.closed:
+                asyncio.run_coroutine_threadsafe(self._session.close(), loop).result(timeout=5)
+        except Exception as e:
+            print(f"Error closing Understat session: {e}")
+        finally:
+            self._session = None
+            loop.call_soon_threadsafe(loop.stop)
+            if self._thread is not None:
+                self._thread.join(timeout=5)
+            loop.close()
+
+
+_client = None
+
+def get_understat_client():
+    """Get the app wide Understat client, creating it with defaults if create_app hasn't yet"""
+    global _client
+    if _client is None:
+        _client = UnderstatClient()
+        atexit.register(_client.close)
+    return _client
+
+def init_understat_client(app):
+    """Build the shared client from app config. Called once from create_app."""
+    global _client
+    if _client is not None:
+        _client.close()
+    mode = app.config.get("UNDERSTAT_MODE", "live")
+    # Mirror only in live mode: when recording every call has to reach Understat and when
+    # replaying the recorded fixtures are the only source
+    use_mirror = app.config.get("UNDERSTAT_MIRROR", True) and mode == "live"
+    _client = UnderstatClient(
+        limit=app.config.get("UNDERSTAT_CONN_LIMIT", 30),
+        limit_per_host=app.config.get("UNDERSTAT_CONN_LIMIT_PER_HOST", 10),
+        keepalive_timeout=app.config.get("UNDERSTAT_KEEPALIVE_TIMEOUT", 60),
+        request_timeout=app.config.get("UNDERSTAT_REQUEST_TIMEOUT", 20),
+        cache_size=app.config.get("UNDERSTAT_CACHE_SIZE", 512),
+        mirror=UnderstatMirror(app.config.get("UNDERSTAT_MIRROR_DATABASE", MIRROR_DATABASE)) if use_mirror else None,
+        mode=mode,
+        fixture_dir=app.config.get("UNDERSTAT_FIXTURE_DIR", "understat_fixtures"),
+        replay_latency=app.config.get("UNDERSTAT_REPLAY_LATENCY", 0.0)
+    )
+    atexit.register(_client.close)
+    app.extensions["understat_client"] = _client
+    return _client
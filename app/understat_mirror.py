@@ -0,0 +1,247 @@
+import asyncio
+import hashlib
+import json
+import time
+from sqlite3 import Error
+from .match_index import INDEXED_ENDPOINTS
+from .db import get_pool
+
+'''LOCAL UNDERSTAT MIRROR'''
+# Keeps a copy of every Understat response in its own SQLite file next to scoracle.db (separate file so
+# syncing never holds a lock on the bets database). The shared client reads from here first and only
+# goes upstream when the copy is older than its TTL, and falls back to the copy if Understat is down.
+
+MIRROR_DATABASE = 'understat_mirror.db'
+
+def resource_key(args, kwargs):
+    """Same call -> same key, e.g. get_league_table("epl", 2024, with_headers=False)"""
+    return json.dumps([list(args), sorted(kwargs.items())], separators=(",", ":"))
+
+
+class UnderstatMirror:
+    def __init__(self, path=MIRROR_DATABASE):
+        self.path = path
+        self.init_db()
+
+    def get_connection(self):
+        # Pooled WAL connections, so a sync writing snapshots doesn't block pages reading them. Never
+        # the request's connection, the mirror is used from the client's own threads
+        return get_pool(self.path).connection(request_scoped=False)
+
+    def init_db(self):
+        conn = self.get_connection()
+        try:
+            c = conn.cursor()
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS understat_snapshots (
+                    endpoint TEXT NOT NULL,
+                    resource TEXT NOT NULL,
+                    payload TEXT NOT NULL,
+                    payload_hash TEXT NOT NULL,
+                    fetched_at REAL NOT NULL,
+                    changed_at REAL NOT NULL,
+                    PRIMARY KEY (endpoint, resource)
+                )
+            ''')
+            # Every fixture/result by id, kept in step with the league lists above
+            c.execute('''
+                CREATE TABLE IF NOT EXISTS understat_matches (
+                    match_id TEXT PRIMARY KEY,
+                    league TEXT NOT NULL,
+                    season INTEGER NOT NULL,
+                    is_result INTEGER NOT NULL,
+                    payload TEXT NOT NULL
+                )
+            ''')
+            conn.commit()
+        except Error as e:
+            print(f"Error creating Understat mirror: {e}")
+        finally:
+            conn.close()
+
+    def get(self, endpoint, args, kwargs):
+        """Return (payload, age in seconds) or None if this call was never mirrored"""
+        conn = self.get_connection()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT payload, fetched_at FROM understat_snapshots WHERE endpoint = ? AND resource = ?",
+                      (endpoint, resource_key(args, kwargs)))
+            row = c.fetchone()
+            if row is None:
+                return None
+            return json.loads(row["payload"]), time.time() - row["fetched_at"]
+        except Error as e:
+            print(f"Error reading Understat mirror: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def has(self, endpoint, args, kwargs):
+        conn = self.get_connection()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT 1 FROM understat_snapshots WHERE endpoint = ? AND resource = ?",
+                      (endpoint, resource_key(args, kwargs)))
+            return c.fetchone() is not None
+        except Error as e:
+            print(f"Error reading Understat mirror: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def put(self, endpoint, args, kwargs, payload):
+        """Store a response. Returns True if the data actually changed since the last copy."""
+        body = json.dumps(payload, separators=(",", ":"))
+        payload_hash = hashlib.sha1(body.encode("utf-8")).hexdigest()
+        now = time.time()
+        conn = self.get_connection()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT payload_hash FROM understat_snapshots WHERE endpoint = ? AND resource = ?",
+                      (endpoint, resource_key(args, kwargs)))
+            existing = c.fetchone()
+            if existing and existing["payload_hash"] == payload_hash:
+                # Same data, just mark it as fresh
+                c.execute("UPDATE understat_snapshots SET fetched_at = ? WHERE endpoint = ? AND resource = ?",
+                          (now, endpoint, resource_key(args, kwargs)))
+                changed = False
+            else:
+                c.execute('''
+                    INSERT OR REPLACE INTO understat_snapshots
+                    (endpoint, resource, payload, payload_hash, fetched_at, changed_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                ''', (endpoint, resource_key(args, kwargs), body, payload_hash, now, now))
+                changed = True
+                if endpoint in INDEXED_ENDPOINTS and not kwargs:
+                    self._index_matches(c, payload, args[0], args[1], INDEXED_ENDPOINTS[endpoint])
+            conn.commit()
+            return changed
+        except Error as e:
+            print(f"Error writing Understat mirror: {e}")
+            return False
+        finally:
+            conn.close()
+
+    def _index_matches(self, c, matches, league, season, is_result):
+        # A result never gets turned back into a fixture by an older fixtures list
+        c.executemany('''
+            INSERT INTO understat_matches (match_id, league, season, is_result, payload)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(match_id) DO UPDATE SET
+                league = excluded.league, season = excluded.season,
+                is_result = excluded.is_result, payload = excluded.payload
+            WHERE excluded.is_result >= understat_matches.is_result
+        ''', [(str(match["id"]), league, season, int(is_result), json.dumps(match, separators=(",", ":")))
+              for match in matches])
+
+    def get_match(self, match_id):
+        """Return {"match", "league", "season", "is_result"} for a mirrored match or None"""
+        conn = self.get_connection()
+        try:
+            c = conn.cursor()
+            c.execute("SELECT league, season, is_result, payload FROM understat_matches WHERE match_id = ?",
+                      (str(match_id),))
+            row = c.fetchone()
+            if row is None:
+                return None
+            return {"match": json.loads(row["payload"]), "league": row["league"],
+                    "season": row["season"], "is_result": bool(row["is_result"])}
+        except Error as e:
+            print(f"Error reading mirrored match: {e}")
+            return None
+        finally:
+            conn.close()
+
+    def get_matches(self, match_ids):
+        """get_match for many ids in one query, {match_id: entry} for the ones that are mirrored"""
+        match_ids = [str(match_id) for match_id in match_ids]
+        if not match_ids:
+            return {}
+        conn = self.get_connection()
+        try:
+            c = conn.cursor()
+            placeholders = ",".join("?" * len(match_ids))
+            c.execute(f"SELECT match_id, league, season, is_result, payload FROM understat_matches WHERE match_id IN ({placeholders})",
+                      match_ids)
+            return {row["match_id"]: {"match": json.loads(row["payload"]), "league": row["league"],
+                                      "season": row["season"], "is_result": bool(row["is_result"])}
+                    for row in c.fetchall()}
+        except Error as e:
+            print(f"Error reading mirrored matches: {e}")
+            return {}
+        finally:
+            conn.close()
+
+
+async def sync_mirror(client, leagues, season, concurrency=8):
+    """
+    Pull everything the app reads for these leagues into the mirror. League level lists are always
+    refreshed (few calls), team data only for teams with new results and match players/shots only
+    for finished matches the mirror hasn't seen yet.
+    """
+    mirror = client.mirror
+    if mirror is None:
+        return {"success": False, "message": "Understat mirror is disabled"}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    summary = {"success": True, "leagues": 0, "changed": 0, "teams_refreshed": 0, "matches_added": 0, "errors": 0}
+
+    async def refresh(method, *args, **kwargs):
+        async with semaphore:
+            try:
+                result, changed = await client.refresh(method, *args, **kwargs)
+                if changed:
+                    summary["changed"] += 1
+                return result
+            except Exception as e:
+                print(f"Error syncing {method} {args}: {e}")
+                summary["errors"] += 1
+                return None
+
+    for league in leagues:
+        # What we had last time decides what counts as new
+        previous = mirror.get("get_league_results", (league, season), {})
+        seen_ids = {match["id"] for match in previous[0]} if previous else set()
+
+        await refresh("get_league_fixtures", league, season)
+        await refresh("get_league_table", league, season, with_headers=False)
+        await refresh("get_teams", league, season)
+        try:
+            results = await client.fetch_upstream("get_league_results", league, season)
+        except Exception as e:
+            print(f"Error syncing results for {league}: {e}")
+            summary["errors"] += 1
+            continue
+
+        new_results = [match for match in results if match["id"] not in seen_ids]
+        changed_teams = set()
+        for match in new_results:
+            changed_teams.add(match["h"]["title"])
+            changed_teams.add(match["a"]["title"])
+
+        team_jobs = []
+        for team in changed_teams:
+            team_jobs.append(refresh("get_team_results", team, season))
+            team_jobs.append(refresh("get_team_players", team, season))
+            team_jobs.append(refresh("get_team_fixtures", team, season))
+
+        match_jobs = []
+        for match in new_results:
+            if not mirror.has("get_match_players", (match["id"],), {}):
+                match_jobs.append(refresh("get_match_players", match["id"]))
+            if not mirror.has("get_match_shots", (match["id"],), {}):
+                match_jobs.append(refresh("get_match_shots", match["id"]))
+
+        await asyncio.gather(*team_jobs, *match_jobs)
+
+        # Only save the results list once everything it points at is mirrored, so a crash half way
+        # means those matches still count as new next run
+        if mirror.put("get_league_results", (league, season), {}, results):
+            summary["changed"] += 1
+        client.cache.delete(("get_league_results", (league, season), ()))
+
+        summary["leagues"] += 1
+        summary["teams_refreshed"] += len(changed_teams)
+        summary["matches_added"] += len(new_results)
+
+    return summary
@@ -0,0 +1,43 @@
+import asyncio
+import hashlib
+import json
+import os
+from .understat_mirror import resource_key
+
+'''RECORD / REPLAY FOR UNDERSTAT TRAFFIC'''
+# record: every real Understat response is also written to fixture_dir
+# replay: responses come from fixture_dir only (no network) after an injected delay,
+#         so routes and prediction code can be load tested / profiled offline
+
+MODES = ("live", "record", "replay")
+
+class FixtureStore:
+    def __init__(self, fixture_dir, latency=0.0):
+        self.fixture_dir = fixture_dir
+        self.latency = latency  # Seconds added to every replayed call to look like a real round trip
+
+    def _path(self, method, args, kwargs):
+        key = resource_key(args, kwargs)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+        return os.path.join(self.fixture_dir, method, f"{name}.json")
+
+    def save(self, method, args, kwargs, payload):
+        path = self._path(method, args, kwargs)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            # Args kept in the file so a human can tell which call it was
+            json.dump({"method": method, "args": list(args), "kwargs": kwargs, "payload": payload}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, method, args, kwargs):
+        path = self._path(method, args, kwargs)
+        if not os.path.exists(path):
+            raise LookupError(f"No recorded Understat response for {method}{tuple(args)} in {self.fixture_dir}")
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)["payload"]
+
+    async def replay(self, method, args, kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self.load(method, args, kwargs)